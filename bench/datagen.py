@@ -0,0 +1,79 @@
+"""Синтетические данные для бенчмарков: пользователи с заметками, файлами и напоминаниями.
+
+    python bench/datagen.py bench.db [профиль]
+
+Профили (PROFILES): small - пользователи с 10, 1 000 и 10 000 заметок; large - плюс 1 000 000.
+Пишет пачками через SQLAlchemy (триггеры FTS и теги заполняются как при обычной работе бота).
+"""
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import insert, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db
+
+# user_id: (заметок, файлов, напоминаний)
+PROFILES = {
+    "small": {1: (10, 5, 2), 2: (1_000, 100, 20), 3: (10_000, 1_000, 100)},
+    "large": {1: (10, 5, 2), 2: (1_000, 100, 20), 3: (10_000, 1_000, 100), 4: (1_000_000, 10_000, 1_000)},
+}
+WORDS = ("купить молоко хлеб позвонить маме встреча проект отчет идея книга фильм спорт врач "
+         "работа дом дача отпуск подарок пароль адрес рецепт список задача план неделя").split()
+TAGS = ("работа", "дом", "идея", "покупки", "важно")
+FILE_TYPES = ("photo", "video", "document", "voice")
+BATCH = 10_000
+
+def note_text(rnd: random.Random, i: int):
+    words = " ".join(rnd.choices(WORDS, k=rnd.randint(3, 20)))
+    return f"{words} #{rnd.choice(TAGS)} {i}" if rnd.random() < 0.2 else f"{words} {i}"
+
+async def generate(profile: str = "small", seed: int = 1):
+    """Заполняет текущую базу db.engine (схема создается init_db)"""
+    rnd = random.Random(seed)
+    await db.init_db()
+    now = datetime.now()
+    note_id = media_id = reminder_id = 0
+    async with db.engine.begin() as conn:
+        for user_id, (notes, media, reminders) in PROFILES[profile].items():
+            await conn.execute(insert(db.User), [{"telegram_id": user_id, "username": f"user{user_id}"}])
+            first_note = note_id + 1
+            for start in range(0, notes, BATCH):
+                rows, tags = [], []
+                for i in range(start, min(start + BATCH, notes)):
+                    note_id += 1
+                    content = note_text(rnd, i)
+                    rows.append({"id": note_id, "user_id": user_id, "content": content, "is_pinned": rnd.random() < 0.01,
+                                 "created_at": now - timedelta(minutes=notes - i)})
+                    tags += [{"note_id": note_id, "user_id": user_id, "tag": t} for t in db.extract_tags(content)]
+                await conn.execute(insert(db.Note), rows)
+                if tags: await conn.execute(insert(db.NoteTag), tags)
+            for start in range(0, media, BATCH):
+                rows = []
+                for i in range(start, min(start + BATCH, media)):
+                    media_id += 1
+                    rows.append({"id": media_id, "user_id": user_id, "file_id": f"file{media_id}", "file_type": rnd.choice(FILE_TYPES),
+                                 "caption": rnd.choice(WORDS), "created_at": now - timedelta(minutes=media - i)})
+                await conn.execute(insert(db.Media), rows)
+            rows = []
+            for i in range(reminders):
+                reminder_id += 1
+                rows.append({"id": reminder_id, "user_id": user_id, "note_id": rnd.randint(first_note, note_id) if notes else None,
+                             "remind_at": now + timedelta(days=rnd.randint(2, 60), minutes=rnd.randint(0, 1440)),
+                             "is_sent": False, "repeat_interval": rnd.choice(("none", "daily", "weekly"))})
+            if rows: await conn.execute(insert(db.Reminder), rows)
+            await conn.execute(insert(db.UserCounter), [{"user_id": user_id, "notes": notes, "media": media}])
+        if conn.dialect.name == "postgresql":
+            # id заданы явно - двигаем последовательности
+            for table in ("notes", "media", "reminders"):
+                await conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"))
+
+async def main(path: str, profile: str):
+    db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{path}"))
+    await generate(profile)
+    await db.engine.dispose()  # Закрытие последнего соединения переносит WAL в файл базы
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "small"))
@@ -0,0 +1,104 @@
+"""Фейковый Telegram Bot API для нагрузочных тестов (BOT_API_URL=http://127.0.0.1:<порт>).
+
+getUpdates отдает апдейты, добавленные через feed(); остальные методы отвечают успехом
+и записываются (метод, chat_id, время) - по ним считается пропускная способность и задержка.
+"""
+import asyncio
+import itertools
+import json
+import time
+from aiohttp import web
+
+class FakeBotAPI:
+    def __init__(self, port: int = 0, latency: float = 0):
+        self.port = port
+        self.latency = latency  # задержка ответа на методы (имитация сети)
+        self.updates = asyncio.Queue()
+        self.calls = []  # (метод, chat_id, monotonic)
+        self.counts = {}
+        self.last = {}  # chat_id -> параметры последнего send*/edit* (текст, reply_markup)
+        self.sent = {}  # chat_id -> число send*/edit*
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._runner = None
+
+    def feed(self, updates):
+        for u in updates: self.updates.put_nowait(u)
+
+    def message(self, user_id: int, text: str):
+        """Апдейт с текстовым сообщением от пользователя"""
+        return {"update_id": next(self._update_ids), "message": {
+            "message_id": next(self._message_ids), "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}}}
+
+    def callback(self, user_id: int, data: str, message_id: int = 1):
+        """Апдейт с нажатием инлайн-кнопки"""
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "chat_instance": "1", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"},
+            "message": {"message_id": message_id, "date": int(time.time()), "text": "x", "chat": {"id": user_id, "type": "private"}}}}
+
+    def buttons(self, chat_id: int):
+        """{текст: callback_data} инлайн-кнопок последнего сообщения в чат"""
+        markup = self.last.get(chat_id, {}).get("reply_markup")
+        if not markup: return {}
+        rows = json.loads(markup).get("inline_keyboard", []) if isinstance(markup, str) else markup.get("inline_keyboard", [])
+        return {b["text"]: b.get("callback_data") for row in rows for b in row}
+
+    async def wait_calls(self, method: str, n: int, timeout: float = 120):
+        """Ждет, пока метод будет вызван n раз; возвращает False по таймауту"""
+        deadline = time.monotonic() + timeout
+        while self.counts.get(method, 0) < n:
+            if time.monotonic() > deadline: return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def wait_sent(self, chat_id: int, n: int, timeout: float = 120):
+        """Ждет n-й send*/edit* в чат; возвращает False по таймауту"""
+        deadline = time.monotonic() + timeout
+        while self.sent.get(chat_id, 0) < n:
+            if time.monotonic() > deadline: return False
+            await asyncio.sleep(0.005)
+        return True
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        # aiogram шлет form-data, supervisor.py - JSON
+        data = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(float(data.get("timeout") or 0))})
+        chat_id = int(data.get("chat_id", 0) or 0)
+        self.calls.append((method, chat_id, time.monotonic()))
+        self.counts[method] = self.counts.get(method, 0) + 1
+        if self.latency: await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}})
+        if method.startswith("send") or method.startswith("edit"):
+            self.last[chat_id] = data
+            self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+            result = [{"message_id": next(self._message_ids), "date": int(time.time()), "text": str(data.get("text", "")),
+                       "chat": {"id": chat_id, "type": "private"}} for _ in range(len(json.loads(data["media"])) if method == "sendMediaGroup" else 1)]
+            return web.json_response({"ok": True, "result": result if method == "sendMediaGroup" else result[0]})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _get_updates(self, timeout: float, limit: int = 100):
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=min(timeout, 1) or 0.001))
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < limit and not self.updates.empty(): batch.append(self.updates.get_nowait())
+        return batch
+
+    async def start(self):
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        if self._runner: await self._runner.cleanup()
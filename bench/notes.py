@@ -0,0 +1,79 @@
+"""Бенчмарк handle_new_note: сообщений/с и максимальная задержка event loop.
+
+Сравнивает старый синхронный dateparser.parse в хендлере и сервис dates.parser
+(пул потоков + предфильтр + кеш).
+    python bench/notes.py [сообщений] [параллельность]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+import dateparser
+import database as db
+import handlers
+from dates import parser as date_parser
+
+TEXTS = ["купить молоко", "позвонить маме завтра в 10:00", "идея для проекта #работа", "встреча в пятницу в 15:30",
+         "прочитать книгу", "через 2 часа проверить почту", "список покупок: хлеб, сыр", "отчет до 20 декабря"]
+
+class FakeMessage(SimpleNamespace):
+    async def answer(self, text, **kw): pass
+
+async def old_handle_new_note(msg):
+    # Хендлер до выноса dateparser из event loop
+    note_id = await db.add_note(msg.from_user.id, msg.text)
+    now_msk = datetime.now(handlers.MSK_TZ).replace(tzinfo=None)
+    dt = dateparser.parse(msg.text, settings={'PREFER_DATES_FROM': 'future', 'RELATIVE_BASE': now_msk})
+    if dt and dt > now_msk: await db.add_reminder(msg.from_user.id, note_id, dt)
+    await msg.answer("✅")
+
+async def lag_probe(stop, out):
+    # Насколько опаздывает event loop - столько же ждут все остальные апдейты
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.005)
+        out.append(time.perf_counter() - t - 0.005)
+
+async def run(name, handler, total, concurrency):
+    msgs = [FakeMessage(text=random.choice(TEXTS), from_user=SimpleNamespace(id=i % 50)) for i in range(total)]
+    queue = asyncio.Queue()
+    for m in msgs: queue.put_nowait(m)
+
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            try:
+                await handler(queue.get_nowait())
+            except Exception:
+                errors += 1  # "database is locked": loop стоит, пока транзакция другого апдейта не закоммичена
+
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(lag_probe(stop, lags))
+    t = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t
+    stop.set()
+    await probe
+    print(f"{name:>8}: {total / elapsed:7.0f} сообщений/с, макс. задержка loop {max(lags) * 1000:6.1f} мс, ошибок {errors}")
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    await db.init_db()
+    # Загрузка языков в обоих случаях до замера
+    dateparser.parse("завтра в 9:00")
+    await date_parser.warm_up()
+    await run("old", old_handle_new_note, total, concurrency)
+    await run("service", handlers.handle_new_note, total, concurrency)
+
+if __name__ == "__main__":
+    asyncio.run(main())
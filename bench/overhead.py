@@ -0,0 +1,60 @@
+"""Накладные расходы metrics.py: одни и те же апдейты через Dispatcher с METRICS=0 и METRICS=1.
+
+Каждый режим - в отдельном процессе (инструментирование не снимается), Bot API - фейковый.
+    python bench/overhead.py [апдейтов] [повторов]
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+async def run(total: int):
+    from bench.fakeapi import FakeBotAPI
+    from aiogram.fsm.storage.memory import MemoryStorage
+    api = FakeBotAPI()
+    os.environ["BOT_API_URL"] = await api.start()
+    import database as db
+    import bot as app
+    await db.init_db()
+    bot = app.create_bot("1:bench")
+    dp = app.create_dispatcher(MemoryStorage())
+    await db.add_user(1, "u")
+    nid = await db.add_note(1, "первая заметка")
+    scenario = [api.message(1, f"заметка {i}") for i in range(5)] + [api.message(1, "👤 Профиль"), api.message(1, "📝 Мои заметки"),
+                api.callback(1, f"view_note_{nid}"), api.callback(1, "list_note_1")]
+    updates = [scenario[i % len(scenario)] for i in range(total)]
+    for u in updates[:50]: await dp.feed_raw_update(bot, u)  # прогрев
+    times = []
+    for u in updates:
+        t = time.perf_counter()
+        await dp.feed_raw_update(bot, u)
+        times.append(time.perf_counter() - t)
+    await bot.session.close()
+    await api.stop()
+    times.sort()
+    print(f"{sum(times) / len(times) * 1e6:.1f} {times[len(times) // 2] * 1e6:.1f} {times[int(len(times) * 0.99)] * 1e6:.1f}")
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    results = {"0": [], "1": []}
+    for _ in range(repeats):
+        for mode in results:
+            out = subprocess.run([sys.executable, __file__, "--run", str(total)], env={**os.environ, "METRICS": mode, "METRICS_PORT": ""},
+                                 cwd=tempfile.mkdtemp(), capture_output=True, text=True, check=True).stdout.split()
+            results[mode].append([float(x) for x in out])
+    for mode, rows in results.items():
+        mean, p50, p99 = (statistics.median(col) for col in zip(*rows))
+        print(f"METRICS={mode}: среднее {mean:7.1f} мкс, p50 {p50:7.1f} мкс, p99 {p99:7.1f} мкс на апдейт")
+    off, on = (statistics.median(r[0] for r in rows) for rows in results.values())
+    print(f"Накладные расходы: {(on - off):+.1f} мкс на апдейт ({(on / off - 1) * 100:+.1f}%)")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]: asyncio.run(run(int(sys.argv[2])))
+    else: main()
@@ -0,0 +1,83 @@
+"""Бенчмарк recurrence.py: следующие срабатывания для многих повторяющихся напоминаний.
+
+    python bench/rrules.py [напоминаний] [перенос в базе]
+
+Напоминания - типовые правила (каждый день, по будням, раз в неделю, раз в месяц, каждые 4 часа)
+в пяти поясах со случайным первым срабатыванием за месяц (шаг 5 минут).
+Замеры: разметка по шаблонам (первая - разбор правил, повторная - только поиск в индексе календаря,
+как в next_times после первой пачки), next_many от одного момента (перенос всех сработавших),
+next_many от своего remind_at у каждого, и process_reminders_repeat на временной SQLite.
+"Итого" - разметка + next_many: полное время для напоминаний, которых календарь еще не видел.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import recurrence as rc
+
+ZONES = ("Europe/Moscow", "Europe/Berlin", "America/New_York", "Asia/Tokyo", "Europe/London")
+RULES = ("FREQ=DAILY", "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR", "FREQ=WEEKLY", "FREQ=MONTHLY", "FREQ=HOURLY;INTERVAL=4")
+
+def reminders(n: int, start: datetime, seed: int = 1):
+    """(правило, пояс, remind_at МСК) - как их хранит база"""
+    rnd = random.Random(seed)
+    texts, msk, rows = {}, {}, []
+    for i in range(n):
+        local = start + timedelta(minutes=rnd.randrange(0, 30 * 1440, 5))
+        rule, tz = RULES[i % len(RULES)], ZONES[rnd.randrange(len(ZONES))]
+        text = texts.get((rule, local)) or texts.setdefault((rule, local), rc.parse(rule).anchored(local).text)
+        at = msk.get((local, tz)) or msk.setdefault((local, tz), rc.to_msk(local, tz))
+        rows.append((text, tz, at))
+    return rows
+
+def timed(label: str, fn):
+    """(результат, секунд)"""
+    t = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t
+    print(f"{label:<44} {elapsed:7.3f} с")
+    return result, elapsed
+
+async def db_advance(rows, now: datetime):
+    """Перенос n сработавших напоминаний в базе одним вызовом process_reminders_repeat"""
+    path = os.path.join(tempfile.mkdtemp(), "rrules.db")
+    import database as db
+    db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{path}"))
+    await db.init_db()
+    async with db.engine.begin() as conn:
+        await conn.execute(db.insert(db.Reminder), [{"user_id": 1, "note_id": 1, "remind_at": now - timedelta(minutes=1), "is_sent": True,
+                                                     "repeat_interval": text, "tz": tz} for text, tz, _ in rows])
+    ids = list(range(1, len(rows) + 1))
+    t = time.perf_counter()
+    await db.process_reminders_repeat(ids, now)
+    print(f"{f'process_reminders_repeat ({len(ids)} в базе)':<44} {time.perf_counter() - t:7.3f} с")
+    await db.engine.dispose()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    in_db = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    start = datetime(2026, 10, 1)
+    now = rc.msk_epoch(datetime(2026, 11, 1))
+    rows, _ = timed(f"генерация {n} напоминаний", lambda: reminders(n, start))
+    assign = lambda: array("l", (rc.calendar.pattern(text, tz) for text, tz, _ in rows))
+    patterns, cold = timed("разметка по шаблонам (первая)", assign)
+    _, warm = timed("разметка по шаблонам (повторная)", assign)
+    print(f"    шаблонов: {len(rc.calendar._rules)}")
+    after = array("d", (rc.msk_epoch(at) for _, _, at in rows))
+    _, first = timed("next_many от одного момента (холодный)", lambda: rc.calendar.next_many(patterns, now))
+    _, shared = timed("next_many от одного момента", lambda: rc.calendar.next_many(patterns, now))
+    _, own = timed("next_many от своего remind_at", lambda: rc.calendar.next_many(patterns, after))
+    timed("next_times, пачка 1000", lambda: rc.next_times(rows[:1000], datetime(2026, 11, 1)))
+    print(f"{'итого, от одного момента (первый раз)':<44} {cold + first:7.3f} с")
+    print(f"{'итого, от одного момента (повторно)':<44} {warm + shared:7.3f} с")
+    print(f"{'итого, от своего remind_at (повторно)':<44} {warm + own:7.3f} с")
+    if in_db: asyncio.run(db_advance(rows[:in_db], datetime(2026, 11, 1)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Бенчмарк поиска: FTS5 (db.search_notes) против старого ILIKE (db.get_notes_page).
+
+    python bench/search.py [10000,100000,1000000]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())  # bot.db создается в текущей папке
+import database as db
+from sqlalchemy import insert
+
+WORDS = "привет мир работа дом встреча купить молоко позвонить маме отчет проект идея книга фильм спорт".split()
+USER = 1
+
+async def fill(total: int, have: int):
+    async with db.engine.begin() as conn:
+        for start in range(have, total, 10000):
+            rows = [{"user_id": USER if i % 10 == 0 else 1000 + i % 97,
+                     "content": " ".join(random.choices(WORDS, k=8)) + f" #{random.choice(WORDS)} слово{i}"}
+                    for i in range(start, min(start + 10000, total))]
+            await conn.execute(insert(db.Note), rows)
+
+async def timeit(fn, *args, repeat=20):
+    t = time.perf_counter()
+    for _ in range(repeat): await fn(*args)
+    return (time.perf_counter() - t) / repeat * 1000
+
+async def main():
+    sizes = [int(x) for x in (sys.argv[1] if len(sys.argv) > 1 else "10000,100000").split(",")]
+    await db.init_db()
+    have = 0
+    print(f"{'notes':>9} {'query':>10} {'ilike ms':>9} {'fts ms':>8}")
+    for size in sizes:
+        await fill(size, have)
+        have = size
+        for q in ("встреча", "позв", "#проект", f"слово{size - 10}"):
+            like = await timeit(db.get_notes_page, USER, 1, 10, q.lstrip("#"))
+            fts = await timeit(db.search_notes, USER, q)
+            print(f"{size:>9} {q:>10} {like:>9.2f} {fts:>8.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
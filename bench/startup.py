@@ -0,0 +1,62 @@
+"""Бенчмарк запуска: время от старта процесса до ответа на первый апдейт.
+
+    python bench/startup.py [-n запусков] [--fresh] [--workers N]
+
+Фейковый Bot API (bench/fakeapi.py) заранее держит апдейты: /start и заметку с датой.
+bot.py запускается отдельным процессом (long polling, STARTUP_REPORT=1 - отчет первого запуска
+печатается) на копии базы bench/datagen.py; --fresh - на пустой базе (схема и все миграции).
+--workers N - supervisor.py с N воркерами, /start от N пользователей (по одному на воркер).
+Замеры от запуска процесса: первый ответ, ответ всем (/start каждого воркера и заметка с датой).
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench.fakeapi import FakeBotAPI
+from bench.suite import dataset, percentile
+
+async def run_once(source, workers: int, report: bool):
+    api = FakeBotAPI()
+    url = await api.start()
+    work = tempfile.mkdtemp()
+    path = os.path.join(work, "bot.db")
+    if source: shutil.copy(source, path)
+    api.feed([api.message(500 + i, "/start") for i in range(max(workers, 1))] + [api.message(500, "позвонить маме завтра в 10:00")])
+    env = {**os.environ, "BOT_TOKEN": "1:bench", "BOT_API_URL": url, "DATABASE_URL": f"sqlite+aiosqlite:///{path}",
+           "FSM_STORAGE": "memory", "METRICS_PORT": "", "STARTUP_REPORT": "1", "WORKERS": str(workers)}
+    script = os.path.join(ROOT, "supervisor.py" if workers else "bot.py")
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(sys.executable, script, env=env, cwd=work,
+                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    ok = await api.wait_calls("sendMessage", 1, timeout=120)
+    first = time.monotonic() - start
+    ok = ok and await api.wait_calls("sendMessage", max(workers, 1) + 1, timeout=120)
+    everyone = time.monotonic() - start
+    proc.terminate()
+    out = (await proc.communicate())[0].decode()
+    await api.stop()
+    shutil.rmtree(work, ignore_errors=True)
+    if not ok: raise RuntimeError(f"Нет ответа от {os.path.basename(script)}:\n{out[-2000:]}")
+    if report: print(out.strip())
+    return first, everyone
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5, help="запусков")
+    parser.add_argument("--fresh", action="store_true", help="пустая база")
+    parser.add_argument("--workers", type=int, default=0, help="supervisor.py с N воркерами")
+    args = parser.parse_args()
+    source = None if args.fresh else dataset("small")
+    results = [await run_once(source, args.workers, i == 0) for i in range(args.n)]
+    for i, label in enumerate(("первый ответ", "ответ всем")):
+        values = [r[i] for r in results]
+        print(f"{label:<14} p50 {percentile(values, 0.5) * 1000:7.0f} мс   мин {min(values) * 1000:7.0f}   макс {max(values) * 1000:7.0f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+"""Набор бенчмарков хендлеров с фейковым Bot API и сравнением с сохраненным baseline.
+
+    python bench/suite.py                      - все сценарии, сравнение с bench/baseline.json
+    python bench/suite.py --save               - сохранить результаты как новый baseline
+    python bench/suite.py --profile large      - данные с пользователем на 1 000 000 заметок
+    python bench/suite.py create paging        - только выбранные сценарии
+
+Каждый сценарий идет в отдельном процессе на копии сгенерированной базы (bench/datagen.py):
+апдейты подаются в Dispatcher (handlers.router), ответы принимает bench/fakeapi.py.
+Отчет: число операций, операций/с, p50/p99 задержки, пиковый RSS процесса.
+Регрессия - p50 или p99 хуже baseline больше чем на THRESHOLD (код выхода 1).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+THRESHOLD = 0.3
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0
+
+async def measure(ops, concurrency: int = 1):
+    """Выполняет корутины-фабрики ops не больше concurrency одновременно. (задержки, общее время)"""
+    sem = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def one(op):
+        async with sem:
+            t = time.perf_counter()
+            await op()
+            times.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(op) for op in ops))
+    return times, time.perf_counter() - start
+
+# --- Сценарии: async fn(ctx) -> (задержки, время) ---
+async def create(ctx):
+    """Новые заметки (часть - с датой: dateparser + напоминание), 20 пользователей параллельно"""
+    api, feed = ctx["api"], ctx["feed"]
+    texts = ["купить молоко", "позвонить маме завтра в 10:00", "идея #работа", "встреча в пятницу в 15:30", "прочитать книгу"]
+    return await measure([lambda i=i: feed(api.message(100 + i % 20, f"{texts[i % len(texts)]} {i}")) for i in range(ctx["n"])], 20)
+
+async def paging(ctx):
+    """Листание заметок самого большого пользователя вперед по кнопке ➡️"""
+    api, feed, user = ctx["api"], ctx["feed"], ctx["heavy"]
+    ops = []
+    for _ in range(ctx["n"]):
+        async def op():
+            data = api.buttons(user).get("➡️") or "list_note_1"
+            await feed(api.callback(user, data))
+        ops.append(op)
+    return await measure(ops)
+
+async def search(ctx):
+    """Поиск по словам (FTS) и хештегам у самого большого пользователя"""
+    api, feed, user = ctx["api"], ctx["feed"], ctx["heavy"]
+    queries = ["молоко", "встреча проект", "#работа", "отчет", "#идея", "книга фильм"]
+    ops = []
+    for i in range(ctx["n"]):
+        async def op(q=queries[i % len(queries)]):
+            await feed(api.message(user, "🔍 Поиск"))
+            await feed(api.message(user, q))
+        ops.append(op)
+    return await measure(ops)
+
+async def profile(ctx):
+    """Профиль (статистика) и просмотр заметки - горячие чтения"""
+    api, feed, user = ctx["api"], ctx["feed"], ctx["heavy"]
+    return await measure([lambda i=i: feed(api.message(user, "👤 Профиль") if i % 2 else api.callback(user, f"view_note_{ctx['first_note'] + i % 50}"))
+                          for i in range(ctx["n"])])
+
+async def export(ctx):
+    """Бэкап jsonl.gz самого большого пользователя"""
+    api, feed, user = ctx["api"], ctx["feed"], ctx["heavy"]
+    return await measure([lambda: feed(api.callback(user, "export_jsonl_gz")) for _ in range(max(ctx["n"] // 100, 3))])
+
+async def reminders(ctx):
+    """Всплеск напоминаний: n сработавших сразу, планировщик + отправка без лимитов Telegram"""
+    import database as db
+    from delivery import ReminderDelivery
+    from scheduler import ReminderScheduler, now_msk
+    api, bot, n = ctx["api"], ctx["bot"], ctx["n"]
+    async with db.engine.begin() as conn:
+        await conn.execute(db.insert(db.Reminder), [{"user_id": 1000 + i, "note_id": 1, "remind_at": now_msk() - timedelta(seconds=1),
+                                                     "is_sent": False, "repeat_interval": "daily" if i % 2 else "none"} for i in range(n)])
+    delivery = ReminderDelivery(bot, workers=16, global_rate=1e6, chat_rate=1e6, flush_interval=0.1)
+    delivery.start()
+    sent = api.counts.get("sendMessage", 0)
+    start = time.monotonic()
+    task = asyncio.create_task(ReminderScheduler(delivery).run())
+    await api.wait_calls("sendMessage", sent + n)
+    elapsed = time.monotonic() - start
+    task.cancel()
+    await delivery.stop()
+    # Задержка - от старта планировщика до отправки каждого напоминания
+    return [t - start for m, _, t in api.calls if m == "sendMessage" and t >= start], elapsed
+
+async def flood(ctx):
+    """Справедливость: один пользователь шлет пачками заметки и листание (n*4 апдейтов разом),
+    20 легких в это же время смотрят профиль. Апдейты идут через настоящий прием: getUpdates
+    фейкового API -> webhook.poll_updates -> WebhookServer.submit (как run_polling в bot.py).
+    Задержка - только у легких, от постановки апдейта в getUpdates до ответа.
+    Проверка: все заметки тяжелого сохранены (отбрасывать можно только повторное листание)"""
+    import bot as app
+    from webhook import WebhookServer, poll_updates
+    api, bot, user = ctx["api"], ctx["bot"], ctx["heavy"]
+    before = await note_count(user)
+    server = WebhookServer(ctx["dp"], bot, concurrency=int(os.getenv("POLLING_CONCURRENCY", 1000)), admit=app.updates.admit)
+    poller = asyncio.create_task(poll_updates(server, timeout=1))
+    api.feed([api.callback(user, "list_note_1") if i % 2 else api.message(user, f"флуд {i}") for i in range(ctx["n"] * 4)])
+
+    async def light(chat: int):
+        times = []
+        for _ in range(ctx["n"] // 20):
+            t, sent = time.perf_counter(), api.sent.get(chat, 0)
+            api.feed([api.message(chat, "👤 Профиль")])
+            if not await api.wait_sent(chat, sent + 1): raise RuntimeError(f"flood: нет ответа пользователю {chat}")
+            times.append(time.perf_counter() - t)
+        return times
+
+    start = time.perf_counter()
+    times = [t for chat in await asyncio.gather(*(light(100 + i) for i in range(20))) for t in chat]
+    elapsed = time.perf_counter() - start
+    while not api.updates.empty() or server._tasks: await asyncio.sleep(0.05)
+    poller.cancel()
+    if (saved := await note_count(user) - before) != ctx["n"] * 2: raise RuntimeError(f"flood: сохранено {saved} заметок из {ctx['n'] * 2}")
+    return times, elapsed
+
+async def note_count(user: int):
+    import database as db
+    async with db.engine.connect() as conn:
+        return await conn.scalar(db.select(db.func.count()).select_from(db.Note).where(db.Note.user_id == user))
+
+SCENARIOS = {"create": (create, 500), "paging": (paging, 300), "search": (search, 200), "profile": (profile, 500),
+             "export": (export, 1000), "reminders": (reminders, 2000), "flood": (flood, 300)}
+
+async def run_scenario(name: str, path: str):
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    from bench.fakeapi import FakeBotAPI
+    from aiogram.fsm.storage.memory import MemoryStorage
+    api = FakeBotAPI()
+    os.environ["BOT_API_URL"] = await api.start()
+    import database as db
+    import bot as app
+    from dates import parser as date_parser
+    await db.init_db()
+    await date_parser.warm_up()
+    bot = app.create_bot("1:bench")
+    dp = app.create_dispatcher(MemoryStorage())
+    from bench.datagen import PROFILES
+    users = PROFILES[os.environ["BENCH_PROFILE"]]
+    heavy = max(users, key=lambda u: users[u][0])  # пользователь с наибольшим числом заметок
+    async with db.engine.connect() as conn:
+        first_note = await conn.scalar(db.select(db.func.min(db.Note.id)).where(db.Note.user_id == heavy))
+
+    async def feed(update):
+        await dp.feed_raw_update(bot, update)
+
+    fn, n = SCENARIOS[name]
+    ctx = {"api": api, "bot": bot, "dp": dp, "feed": feed, "heavy": heavy, "first_note": first_note, "n": int(os.getenv("BENCH_N", n))}
+    times, elapsed = await fn(ctx)
+    await bot.session.close()
+    await api.stop()
+    print(json.dumps({"ops": len(times), "per_sec": round(len(times) / elapsed, 1), "p50_ms": round(percentile(times, 0.5) * 1000, 2),
+                      "p99_ms": round(percentile(times, 0.99) * 1000, 2),
+                      "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}))
+
+def dataset(profile: str):
+    """Путь к сгенерированной базе профиля (кешируется во временной папке)"""
+    path = os.path.join(tempfile.gettempdir(), f"botnapom-bench-{profile}.db")
+    if not os.path.exists(path):
+        print(f"Генерация данных ({profile})...", flush=True)
+        subprocess.run([sys.executable, os.path.join(ROOT, "bench", "datagen.py"), path + ".tmp", profile], check=True)
+        os.replace(path + ".tmp", path)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS))
+    parser.add_argument("--profile", default="small")
+    parser.add_argument("--save", action="store_true", help="сохранить как baseline")
+    args = parser.parse_args()
+    source = dataset(args.profile)
+    baseline = json.load(open(BASELINE)) if os.path.exists(BASELINE) else {}
+    results, regressions = {}, []
+    print(f"{'сценарий':<10} {'опер.':>6} {'опер./с':>9} {'p50 мс':>9} {'p99 мс':>9} {'RSS МБ':>8}")
+    for name in args.scenarios:
+        work = tempfile.mkdtemp()
+        path = os.path.join(work, "bench.db")
+        shutil.copy(source, path)
+        env = {**os.environ, "BENCH_PROFILE": args.profile, "METRICS_PORT": "", "FSM_STORAGE": "memory"}
+        out = subprocess.run([sys.executable, __file__, "--run", name, path], env=env, cwd=work, capture_output=True, text=True)
+        shutil.rmtree(work, ignore_errors=True)
+        if out.returncode:
+            print(f"{name:<10} ошибка:\n{out.stderr[-2000:]}")
+            regressions.append(name)
+            continue
+        r = results[name] = json.loads(out.stdout.strip().splitlines()[-1])
+        base = baseline.get(args.profile, {}).get(name)
+        mark = ""
+        if base:
+            worse = [k for k in ("p50_ms", "p99_ms") if r[k] > base[k] * (1 + THRESHOLD) and r[k] - base[k] > 1]
+            mark = f"  ⚠️ регрессия {', '.join(worse)} (baseline {base['p50_ms']}/{base['p99_ms']})" if worse else \
+                   f"  (baseline p50 {base['p50_ms']}, p99 {base['p99_ms']})"
+            if worse: regressions.append(name)
+        print(f"{name:<10} {r['ops']:>6} {r['per_sec']:>9} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['rss_mb']:>8}{mark}")
+    if args.save:
+        baseline.setdefault(args.profile, {}).update(results)
+        baseline["_meta"] = {"saved": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0], "cpu": os.cpu_count()}
+        with open(BASELINE, "w", encoding="utf-8") as f: json.dump(baseline, f, indent=2, ensure_ascii=False)
+        print(f"Baseline сохранен: {BASELINE}")
+    return 1 if regressions and not args.save else 0
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]: asyncio.run(run_scenario(sys.argv[2], sys.argv[3]))
+    else: sys.exit(main())
@@ -0,0 +1,58 @@
+"""Нагрузочный тест supervisor.py: пропускная способность в зависимости от числа воркеров.
+
+Поднимает фейковый Bot API, запускает supervisor.py с WORKERS=1,2,4... на временной базе
+и отправляет сообщения с датами (dateparser - основная нагрузка на CPU) от многих пользователей.
+    python bench/workers.py [сообщений] [пользователей] [воркеры через запятую]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench.fakeapi import FakeBotAPI
+
+def texts(n: int):
+    rnd = random.Random(1)
+    # Разные тексты, чтобы кеш dateparser не срабатывал
+    return [f"встреча {rnd.randint(1, 28)} числа в {rnd.randint(0, 23)}:{rnd.randint(0, 59):02d} заметка {i}" for i in range(n)]
+
+async def run(workers: int, total: int, users: int):
+    api = FakeBotAPI()
+    url = await api.start()
+    tmp = tempfile.mkdtemp()
+    env = {**os.environ, "BOT_TOKEN": "1:bench", "BOT_API_URL": url, "WORKERS": str(workers), "PYTHONPATH": ROOT,
+           "DATABASE_URL": f"sqlite+aiosqlite:///{tmp}/bench.db", "DB_GROUP_COMMIT_MS": "5", "FSM_STORAGE": "memory"}
+    proc = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "supervisor.py"), env=env, cwd=tmp)
+    # Прогрев: по сообщению на каждого воркера-пользователя, ждем ответов (импорты, языки dateparser)
+    api.feed([api.message(u, "завтра в 10:00") for u in range(1, workers + 1)])
+    await api.wait_calls("sendMessage", workers, timeout=300)
+    sent = api.counts["sendMessage"]
+
+    t = time.perf_counter()
+    api.feed([api.message(1 + i % users, text) for i, text in enumerate(texts(total))])
+    ok = await api.wait_calls("sendMessage", sent + total)
+    elapsed = time.perf_counter() - t
+    done = api.counts["sendMessage"] - sent
+    proc.terminate()
+    await proc.wait()
+    await api.stop()
+    print(f"WORKERS={workers}: {done / elapsed:7.1f} сообщений/с ({done}/{total} за {elapsed:.1f} с{'' if ok else ', таймаут'})")
+    return done / elapsed
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    counts = [int(x) for x in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 2, 4]
+    print(f"CPU: {os.cpu_count()}")
+    base = None
+    for n in counts:
+        rate = await run(n, total, users)
+        base = base or rate
+        print(f"    ускорение x{rate / base:.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
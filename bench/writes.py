@@ -0,0 +1,45 @@
+"""Нагрузочный бенчмарк записи: add_note из многих параллельных задач.
+
+Сравнивает настройки SQLite по умолчанию, WAL+pragmas и WAL+групповую запись.
+    python bench/writes.py [всего_заметок] [параллельность]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+import database as db
+
+async def run(name, pragmas, group_ms, total, concurrency):
+    db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{name}.db", pragmas))
+    db.writer = db.GroupCommit(group_ms / 1000) if group_ms else None
+    await db.init_db()
+
+    errors = 0
+
+    async def worker(w):
+        nonlocal errors
+        for i in range(total // concurrency):
+            try:
+                await db.add_note(w, f"заметка {w}-{i} #bench")
+            except Exception:
+                errors += 1  # "database is locked" под нагрузкой
+
+    t = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - t
+    await db.engine.dispose()
+    print(f"{name:>10}: {(total - errors) / elapsed:8.0f} записей/с ({elapsed:.2f} с, ошибок {errors})")
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    await run("default", {}, 0, total, concurrency)
+    await run("wal", db.SQLITE_PRAGMAS, 0, total, concurrency)
+    await run("wal+group", db.SQLITE_PRAGMAS, 5, total, concurrency)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,58 +1,128 @@
-import asyncio
-import logging
-import os
-import pytz # ТАЙМЗОНА
-from datetime import datetime
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
-
-import database as db
-from handlers import router
-
-async def scheduler(bot: Bot):
-    msk = pytz.timezone('Europe/Moscow')
-    while True:
-        try:
-            # Сравниваем время
-            now_msk = datetime.now(msk).replace(tzinfo=None)
-            reminders = await db.get_pending_reminders(now_msk)
-            
-            for r, note in reminders:
-                try:
-                    await bot.send_message(r.user_id, f"🔔 <b>Напоминание!</b>\n\n{note.content}", parse_mode="HTML")
-                    
-                    # ОБРАБОТКА ПОВТОРА (или удаление)
-                    await db.process_reminder_repeat(r.id)
-                    
-                except Exception as e:
-                    logging.error(f"Send err: {e}")
-        except Exception as e:
-            logging.error(f"Sched err: {e}")
-        await asyncio.sleep(60)
-
-async def main():
-    logging.basicConfig(level=logging.WARNING)
-    bot_token = os.getenv("BOT_TOKEN") or os.getenv("TOKEN")
-    if not bot_token: return print("❌ Нет токена")
-
-    await db.init_db()
-    
-    bot = Bot(token=bot_token)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
-
-    print("🚀 Bot v4.0 Ultimate (MSK Timezone + Repeats)")
-    asyncio.create_task(scheduler(bot))
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except (KeyboardInterrupt, SystemExit):
-        pass
+import asyncio
+import logging
+import os
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import startup  # STARTUP_REPORT=1 - время фаз запуска (до тяжелых импортов)
+startup.mark("запуск Python")
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+startup.mark("импорт aiogram")
+
+import database as db
+from handlers import router, coalesce_key
+from scheduler import ReminderScheduler
+from delivery import ReminderDelivery
+from dates import parser as date_parser
+from storage import build_storage, run_purge, live_states
+from ordering import UserScheduler
+import media
+import metrics
+startup.mark("импорт модулей бота")
+
+# UPDATE_CONCURRENCY - апдейтов в работе одновременно (все пользователи), USER_QUEUE_SIZE - очередь одного пользователя,
+# после которой прием его апдейтов ждет (webhook, supervisor.py)
+updates = UserScheduler(int(os.getenv("UPDATE_CONCURRENCY", 32)), int(os.getenv("USER_QUEUE_SIZE", 20)), coalesce_key)
+
+def create_bot(token: str):
+    # BOT_API_URL - свой сервер Bot API (локальный или фейковый для нагрузочных тестов)
+    api_url = os.getenv("BOT_API_URL")
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+    bot = Bot(token=token, session=session)
+    if metrics.ENABLED: metrics.instrument_bot(bot)
+    return bot
+
+def create_dispatcher(storage):
+    if metrics.ENABLED:
+        metrics.instrument_router(router)
+        metrics.instrument_db(db)
+    # Очередь по пользователям - до FSM, чтобы состояние читалось уже по порядку (см. ordering.py)
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.update.outer_middleware(updates)
+    dp.update.outer_middleware(dp.fsm)
+    dp.include_router(router)
+    return dp
+
+async def warm_up(delay: float = float(os.getenv("DATE_WARMUP_DELAY", 1))):
+    """Языковые данные dateparser грузятся в фоне - через delay секунд, чтобы загрузка (держит GIL)
+    не тормозила первые апдейты. Заметка с датой до этого просто загрузит dateparser сама"""
+    await asyncio.sleep(delay)
+    await date_parser.warm_up()
+    startup.event("dateparser загружен")
+
+def start_background(bot: Bot, storage, shard=None):
+    """Запускает фоновые задачи (dateparser, отправка и планировщик напоминаний, очистка FSM).
+    shard=(номер, всего) - планировщик берет только свою долю напоминаний (см. supervisor.py).
+    METRICS_PORT - /metrics (у воркеров supervisor.py - METRICS_PORT + 1 + номер).
+    Возвращает корутину-функцию корректной остановки"""
+    asyncio.create_task(warm_up())
+    delivery = ReminderDelivery(bot, workers=int(os.getenv("DELIVERY_WORKERS", 8)))
+    delivery.start()
+    scheduler = ReminderScheduler(delivery, shard=shard)
+    background = [asyncio.create_task(scheduler.run()), asyncio.create_task(run_purge(storage))]
+    if metrics.ENABLED:
+        metrics.Gauge("reminders_scheduled", "Напоминаний в куче планировщика", lambda: len(scheduler._due))
+        metrics.Gauge("reminders_backlog", "Забранных и еще не сохраненных после отправки напоминаний", lambda: len(delivery.inflight))
+        metrics.Gauge("delivery_queue", "Очередь отправки напоминаний", delivery.queue.qsize)
+        metrics.Gauge("db_cache_hits", "Попадания кеша database.py", lambda: db.cache.hits)
+        metrics.Gauge("db_cache_misses", "Промахи кеша database.py", lambda: db.cache.misses)
+        metrics.Gauge("date_parser_hits", "Попадания кеша разбора дат", lambda: date_parser.hits)
+        metrics.Gauge("date_parser_misses", "Вызовы dateparser", lambda: date_parser.misses)
+        metrics.Gauge("fsm_states", "Живых состояний FSM (раз в минуту)", lambda: live_states(storage))
+        metrics.Gauge("fsm_cache_hits", "Попадания кеша FSM (CachedStorage)", lambda: getattr(storage, "hits", None))
+        metrics.Gauge("fsm_cache_misses", "Промахи кеша FSM (CachedStorage)", lambda: getattr(storage, "misses", None))
+        metrics.Gauge("media_buffered", "Файлов в буфере альбомов", lambda: media.buffer.pending)
+        metrics.Gauge("updates_running", "Апдейтов в обработке", lambda: updates.running)
+        metrics.Gauge("updates_queued", "Апдейтов в очередях пользователей", lambda: updates.queued)
+        metrics.Gauge("updates_queue_max", "Самая длинная очередь пользователя", lambda: updates.deepest)
+        metrics.Gauge("updates_admitted", "Принятых и не обработанных апдейтов (webhook, воркеры)", lambda: updates.admitted)
+        metrics.Gauge("updates_throttled", "Приемов апдейтов, ждавших места в очереди пользователя", lambda: updates.throttled)
+        metrics.Gauge("updates_coalesced", "Отброшено повторных апдейтов (листание, кнопки меню)", lambda: updates.coalesced)
+        if port := os.getenv("METRICS_PORT"):
+            port = int(port) + (shard[0] + 1 if shard else 0)
+            asyncio.create_task(metrics.serve(port, os.getenv("METRICS_HOST", "127.0.0.1")))
+
+    async def shutdown():
+        # Останавливаем планировщик и отправляем уже забранные напоминания
+        for t in background: t.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await delivery.stop()
+        await media.buffer.close()  # Недосохраненные альбомы
+        await storage.close()
+    return shutdown
+
+def get_token():
+    return os.getenv("BOT_TOKEN") or os.getenv("TOKEN")
+
+async def main():
+    logging.basicConfig(level=logging.WARNING)
+    bot_token = get_token()
+    if not bot_token: return print("❌ Нет токена")
+
+    await db.init_db()
+    startup.mark("база")
+    bot = create_bot(bot_token)
+    storage = build_storage()  # FSM_STORAGE=db|redis|memory
+    dp = create_dispatcher(storage)
+    startup.watch(dp)
+    startup.mark("бот и диспетчер")
+
+    print("🚀 Bot v4.0 Ultimate (MSK Timezone + Repeats)")
+    shutdown = start_background(bot, storage)
+
+    # BOT_MODE=webhook - прием апдейтов через aiohttp-сервер, иначе long polling; прием один (см. webhook.py)
+    from webhook import run_webhook, run_polling
+    run = run_webhook if os.getenv("BOT_MODE", "polling") == "webhook" else run_polling
+    return await run(dp, bot, on_shutdown=shutdown, admit=updates.admit)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        pass
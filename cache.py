@@ -0,0 +1,58 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class AsyncCache:
+    """LRU-кеш с TTL для результатов запросов к базе.
+
+    get(key, loader) - значение из кеша или await loader(); одновременные промахи
+    по одному ключу ждут один и тот же запрос (single-flight).
+    invalidate(key) вызывается при каждой записи; если в этот момент ключ загружается,
+    результат загрузки уже не попадет в кеш (он мог прочитать старые данные)."""
+
+    def __init__(self, size: int = 10000, ttl: float = 60):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (истекает (monotonic), значение)
+        self._loading = {}  # key -> Future
+        self.hits = self.misses = 0
+
+    async def get(self, key, loader):
+        item = self._data.get(key)
+        if item and item[0] > time.monotonic():
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[1]
+        if key in self._loading:
+            self.hits += 1
+            return await asyncio.shield(self._loading[key])
+        self.misses += 1
+        fut = self._loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader()
+        except BaseException as e:
+            if self._loading.get(key) is fut: del self._loading[key]
+            if isinstance(e, asyncio.CancelledError): fut.cancel()
+            else:
+                fut.set_exception(e)
+                fut.exception()  # ошибку получат ожидающие, без "exception was never retrieved"
+            raise
+        if self._loading.get(key) is fut:  # иначе ключ инвалидирован во время загрузки - не сохраняем
+            del self._loading[key]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.size: self._data.popitem(last=False)
+        fut.set_result(value)
+        return value
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+            self._loading.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._loading.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+# Языки разбора дат (DATE_LANGUAGES=ru,en). Без ограничения dateparser перебирает все языки
+LANGUAGES = [lang.strip() for lang in os.getenv("DATE_LANGUAGES", "ru,en").split(",") if lang.strip()]
+
+# Дешевый предфильтр: без цифр и слов о времени dateparser не вызываем
+TIME_HINT_RE = re.compile(
+    r"\d|сегодн|завтр|вчера|через|утр|вечер|ноч|полдень|полноч|обед|час|минут|недел|месяц|год|"
+    r"понедельн|вторник|сред|четверг|пятниц|суббот|воскрес|выходн|"
+    r"январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр|"
+    r"today|tomorrow|tonight|yesterday|morning|evening|night|noon|midnight|hour|minute|week|month|year|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|weekend",
+    re.IGNORECASE)
+
+def _parse(text: str, base: datetime, languages):
+    import dateparser  # Тяжелый импорт - только в пуле
+    return dateparser.parse(text, languages=languages, settings={'PREFER_DATES_FROM': 'future', 'RELATIVE_BASE': base})
+
+def _warm(languages):
+    _parse("завтра в 9:00", datetime.now(), languages)
+
+class DateParser:
+    """Разбор дат из текста вне event loop.
+
+    dateparser медленный (десятки мс, секунды при первой загрузке языков),
+    поэтому вызов уходит в пул потоков (или процессов: DATE_PARSER_PROCESSES=1),
+    а результаты кешируются (LRU) по нормализованному тексту и минуте RELATIVE_BASE."""
+
+    def __init__(self, languages=LANGUAGES, workers: int = 2, processes: bool = False, cache_size: int = 4096):
+        self.languages = languages
+        self.workers = workers
+        self.processes = processes
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pool = None
+        self.hits = self.misses = self.skipped = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.processes:
+                self._pool = ProcessPoolExecutor(self.workers, initializer=_warm, initargs=(self.languages,))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="dateparser")
+        return self._pool
+
+    async def warm_up(self):
+        """Загружает dateparser и языковые данные заранее (на старте, в фоне)"""
+        await asyncio.get_running_loop().run_in_executor(self._get_pool(), _warm, self.languages)
+
+    async def parse(self, text: str, now: datetime):
+        if not text or not TIME_HINT_RE.search(text):
+            self.skipped += 1
+            return None
+        base = now.replace(second=0, microsecond=0)
+        key = (" ".join(text.casefold().split()), base)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        dt = await asyncio.get_running_loop().run_in_executor(self._get_pool(), _parse, text, base, self.languages)
+        self._cache[key] = dt
+        if len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+        return dt
+
+    def shutdown(self):
+        if self._pool: self._pool.shutdown(wait=False, cancel_futures=True)
+
+parser = DateParser(workers=int(os.getenv("DATE_PARSER_WORKERS", 2)), processes=os.getenv("DATE_PARSER_PROCESSES") == "1")
@@ -0,0 +1,164 @@
+import asyncio
+import html
+import logging
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+import database as db
+import metrics
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ReminderDelivery:
+    """Отправка напоминаний пулом воркеров с учетом лимитов Telegram.
+
+    Глобальный лимит ~30 сообщений/с, в один чат ~1 сообщение/с.
+    На RetryAfter все воркеры ставятся на паузу и сообщение повторяется.
+    Доставленные напоминания копятся и переносятся/удаляются пачкой
+    одной транзакцией (db.process_reminders_repeat).
+    Неотправленное напоминание возвращается в базу и через on_retry(id, секунд) - в планировщик:
+    повтор через retry_delay, 2*retry_delay, ...; после max_attempts неудач оно считается
+    обработанным (повторяющееся переносится на следующий раз, разовое удаляется)."""
+
+    def __init__(self, bot: Bot, workers: int = 8, global_rate: float = 30, chat_rate: float = 1,
+                 queue_size: int = 10000, flush_interval: float = 0.5, flush_size: int = 500, max_retries: int = 5,
+                 retry_delay: float = 30, max_attempts: int = 5):
+        self.bot = bot
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.queue = asyncio.Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.attempts = {}  # id -> неудачных отправок подряд (пока ждет повтора)
+        self.on_retry = None  # cb(id, через секунд) - ставит повтор (ReminderScheduler.retry_later)
+        self.inflight = set()  # id напоминаний, которые в очереди или еще не сохранены
+        self._done = []
+        self._paused_until = 0.0
+        self._tasks = []
+        self.sent = self.retries = self.failed = 0
+        self._started = time.monotonic()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {"sent": self.sent, "retries": self.retries, "failed": self.failed,
+                "queue": self.queue.qsize(), "inflight": len(self.inflight), "sent_per_sec": round(self.sent / elapsed, 2)}
+
+    def start(self):
+        self._started = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flusher()))
+
+    async def stop(self):
+        await self.queue.join()
+        for t in self._tasks: t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    async def submit(self, rows):
+        for r, note in rows:
+            if r.id in self.inflight: continue
+            self.inflight.add(r.id)
+            await self.queue.put((r, note, time.monotonic()))
+
+    def _chat_bucket(self, chat_id: int):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Выкидываем давно не использованные (полные) корзины
+                now = time.monotonic()
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if now - b.updated < b.capacity / b.rate}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def _send(self, r, note):
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(r.user_id).acquire()
+            await self.global_bucket.acquire()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0: await asyncio.sleep(pause)
+            try:
+                # Текст заметки - не разметка; 4000 символов с заголовком влезают в лимит сообщения (4096)
+                await self.bot.send_message(r.user_id, f"🔔 <b>Напоминание!</b>\n\n{html.escape(note.content[:4000])}", parse_mode="HTML")
+                self.sent += 1
+                return True
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован / чат не найден - повторять бессмысленно. Остальные BadRequest - не доставлено
+                if isinstance(e, TelegramBadRequest) and "chat not found" not in e.message.lower():
+                    logging.error(f"Send err {r.user_id}: {e}")
+                    break
+                logging.warning(f"Send drop {r.user_id}: {e}")
+                return True
+            except Exception as e:
+                logging.error(f"Send err: {e}")
+                break
+        self.failed += 1
+        return False
+
+    async def _worker(self):
+        while True:
+            r, note, queued = await self.queue.get()
+            metrics.REMINDER_QUEUE.observe(time.monotonic() - queued)
+            try:
+                if await self._send(r, note):
+                    self.attempts.pop(r.id, None)
+                    self._done.append(r.id)
+                else: await self._failed(r)
+            finally:
+                self.queue.task_done()
+            if len(self._done) >= self.flush_size: await self.flush()
+
+    async def _failed(self, r):
+        n = self.attempts.get(r.id, 0) + 1
+        if n >= self.max_attempts:
+            logging.error(f"Reminder {r.id}: {n} неудачных отправок, пропускаем")
+            self.attempts.pop(r.id, None)
+            self._done.append(r.id)
+            return
+        self.attempts[r.id] = n
+        # Снимаем захват и ставим повтор с растущей паузой (без on_retry - подхватит сверка)
+        self.inflight.discard(r.id)
+        await db.release_reminders([r.id])
+        if self.on_retry: self.on_retry(r.id, self.retry_delay * 2 ** (n - 1))
+
+    async def flush(self):
+        if not self._done: return
+        done, self._done = self._done, []
+        try:
+            await db.process_reminders_repeat(done)
+        except Exception as e:
+            # Оставляем в inflight, чтобы сверка не отправила их повторно
+            logging.error(f"Flush err: {e}")
+            self._done = done + self._done
+            return
+        self.inflight.difference_update(done)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            had = bool(self._done)
+            await self.flush()
+            if had and self.queue.empty(): logging.info(f"Delivery: {self.stats()}")
@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from aiogram.types.input_file import InputFile
+
+import database as db
+import recurrence
+
+PART_LIMIT = int(os.getenv("EXPORT_PART_LIMIT", 48 << 20))  # Bot API принимает документы до 50 МБ
+SPOOL_SIZE = 1 << 20  # До 1 МБ в памяти, дальше - временный файл на диске
+_slots = asyncio.Semaphore(int(os.getenv("EXPORT_CONCURRENCY", 2)))
+_active = set()  # Пользователи, у которых бэкап уже готовится
+
+ICONS = {"photo": "🖼", "video": "🎥", "document": "📁", "voice": "🎤"}
+
+def _repeat(rule):
+    return f" ({info})" if (info := recurrence.describe(rule)) else ""
+
+# --- Форматы: заголовок раздела и строка для каждого вида записей ---
+def _txt(kind, row):
+    if kind == "note": return f"{'📌 ' if row.is_pinned else ''}📅 {row.created_at.strftime('%d.%m.%Y')}\n{row.content}\n\n---\n"
+    if kind == "media": return f"{ICONS.get(row.file_type, '❓')} {row.created_at.strftime('%d.%m.%Y')} {row.caption or ''} [{row.file_id}]\n"
+    return f"⏰ {row.remind_at.strftime('%d.%m.%Y %H:%M')}{_repeat(row.repeat_interval)}: {row.content[:100]}\n"
+
+def _jsonl(kind, row):
+    data = {"type": kind, **row._asdict()}
+    return json.dumps(data, ensure_ascii=False, default=lambda v: v.isoformat()) + "\n"
+
+def _md(kind, row):
+    if kind == "note": return f"### {'📌 ' if row.is_pinned else ''}{row.created_at.strftime('%d.%m.%Y %H:%M')}\n\n{row.content}\n\n"
+    if kind == "media": return f"- {ICONS.get(row.file_type, '❓')} {row.created_at.strftime('%d.%m.%Y')} {row.caption or ''} `{row.file_id}`\n"
+    return f"- ⏰ {row.remind_at.strftime('%d.%m.%Y %H:%M')}{_repeat(row.repeat_interval)}: {row.content[:100]}\n"
+
+FORMATS = {
+    # формат: (расширение, строка, заголовки разделов)
+    "txt": ("txt", _txt, {"note": "ВАШИ ЗАМЕТКИ (Backup):\n====================\n\n", "media": "\nФАЙЛЫ:\n====================\n", "reminder": "\nНАПОМИНАНИЯ:\n====================\n"}),
+    "jsonl": ("jsonl", _jsonl, {}),
+    "md": ("md", _md, {"note": "# Заметки\n\n", "media": "\n# Файлы\n\n", "reminder": "\n# Напоминания\n\n"}),
+}
+
+class SpooledInputFile(InputFile):
+    """Документ из временного файла - отдается в Bot API кусками, без чтения целиком в память"""
+
+    def __init__(self, file, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+class _Parts:
+    """Пишет бэкап в части не больше PART_LIMIT (каждая - отдельный документ)"""
+
+    def __init__(self, ext: str, compress: bool):
+        self.ext, self.compress = ext, compress
+        self.files = []
+        self._raw = self._out = None
+        self._size = 0  # несжатых байт в текущей части
+
+    def _open(self):
+        self._raw = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        self._out = gzip.GzipFile(fileobj=self._raw, mode="wb") if self.compress else self._raw
+        self._size = 0
+        n = len(self.files) + 1
+        name = f"backup{'' if n == 1 else f'_{n}'}.{self.ext}" + (".gz" if self.compress else "")
+        self.files.append(SpooledInputFile(self._raw, name))
+
+    def write(self, data: bytes):
+        # Считаем несжатые байты: raw.tell() при gzip отстает на буфер компрессора.
+        # Несжимаемые данные gzip раздувает на ~0.03% + 18 байт заголовка - запаса до 50 МБ хватает
+        if self._raw is None or (self._size + len(data) > PART_LIMIT and self._size):
+            self.finish()
+            self._open()
+        self._out.write(data)
+        self._size += len(data)
+
+    def finish(self):
+        if self._out is not None and self.compress: self._out.close()  # Дописывает хвост gzip, raw остается открытым
+
+    def close(self):
+        self.finish()
+        for f in self.files: f.file.close()
+
+def busy(tg_id: int):
+    return tg_id in _active
+
+@asynccontextmanager
+async def export_files(tg_id: int, fmt: str = "txt", compress: bool = False):
+    """Собирает бэкап (заметки, файлы, напоминания) потоково и отдает список документов.
+    Один бэкап на пользователя и не больше EXPORT_CONCURRENCY одновременно"""
+    ext, line, headers = FORMATS[fmt]
+    parts = _Parts(ext, compress)
+    _active.add(tg_id)
+    try:
+        async with _slots:
+            rows_total = 0
+            for kind in ("note", "media", "reminder"):
+                first = True
+                async for rows in db.stream_export(tg_id, kind):
+                    chunk = "".join(line(kind, r) for r in rows)
+                    if first and kind in headers: chunk = headers[kind] + chunk
+                    first = False
+                    rows_total += len(rows)
+                    # Сжатие и запись на диск - в потоке, чтобы не держать event loop
+                    await asyncio.to_thread(parts.write, chunk.encode("utf-8"))
+            await asyncio.to_thread(parts.finish)
+            yield parts.files if rows_total else []
+    finally:
+        _active.discard(tg_id)
+        parts.close()
@@ -1,17 +1,18 @@
 import math
-import dateparser
-import pytz # <--- ТАЙМЗОНЫ
 from datetime import datetime
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, BufferedInputFile
-from aiogram.filters import CommandStart, StateFilter
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import database as db
+from dates import parser as date_parser
+import export as exporter
+import media
+import recurrence
 
 router = Router()
-MSK_TZ = pytz.timezone('Europe/Moscow') # ЖЕСТКО ЗАДАЕМ МОСКВУ
 
 class BotState(StatesGroup):
     searching = State()
@@ -25,13 +26,34 @@ def main_reply_menu():
     builder.row(KeyboardButton(text="🔍 Поиск"), KeyboardButton(text="👤 Профиль"))
     return builder.as_markup(resize_keyboard=True)
 
-def pagination_kb(page, total_pages, prefix):
+def pagination_kb(page, total_pages, prefix, first=None, last=None):
+    # Курсоры: {prefix}_{стр}_p_{первый} - назад, {prefix}_{стр}_n_{последний} - вперед.
+    # Пустая страница (все удалили) - курсоров нет: назад - на первую, вперед - некуда
     kb = InlineKeyboardBuilder()
-    if page > 1: kb.button(text="⬅️", callback_data=f"{prefix}_{page-1}")
+    if page > 1: kb.button(text="⬅️", callback_data=f"{prefix}_{page-1}_p_{first}" if page > 2 and first else f"{prefix}_1")
     kb.button(text=f"{page}/{total_pages}", callback_data="ignore")
-    if page < total_pages: kb.button(text="➡️", callback_data=f"{prefix}_{page+1}")
+    if page < total_pages and last: kb.button(text="➡️", callback_data=f"{prefix}_{page+1}_n_{last}")
     return kb.as_markup()
 
+def parse_page(data):
+    """'list_note_3_n_<курсор>' -> (3, курсор, назад?); 'list_note_1' -> (1, None, False)"""
+    _, _, page, *rest = data.split("_")
+    if not rest: return 1, None, False
+    return int(page), rest[1], rest[0] == "p"
+
+def coalesce_key(update):
+    """Ключ для ordering.UserScheduler: из ждущих с одним ключом важен только последний.
+    Листание одного сообщения (следующее нажатие все равно его перерисует) и повторные кнопки меню"""
+    if (cb := update.callback_query) and cb.data and cb.message and cb.data.startswith(("list_note_", "list_media_")):
+        return "page", cb.message.message_id
+    if update.message and update.message.text in ("📝 Мои заметки", "💾 Мои файлы", "👤 Профиль"):
+        return "menu", update.message.text
+    return None
+
+def page_cursors(items, key):
+    if not items: return None, None
+    return db.encode_cursor([getattr(items[0], c.key) for c in key]), db.encode_cursor([getattr(items[-1], c.key) for c in key])
+
 def note_control_kb(note_id, is_pinned):
     kb = InlineKeyboardBuilder()
     pin = "🔓" if is_pinned else "📌"
@@ -42,20 +64,29 @@ def note_control_kb(note_id, is_pinned):
     kb.row(InlineKeyboardButton(text="🔙 К списку", callback_data="list_note_1"))
     return kb.as_markup()
 
-def media_control_kb(media_id):
+def media_control_kb(media_id, album=False):
     kb = InlineKeyboardBuilder()
+    if album: kb.button(text="🖼 Весь альбом", callback_data=f"album_{media_id}")
     kb.button(text="🗑 Удалить", callback_data=f"del_media_{media_id}")
     kb.button(text="🔙 К списку", callback_data="list_media_1")
     return kb.as_markup()
 
 def repeat_kb():
+    # repeat_<ключ recurrence.PRESETS>
     kb = InlineKeyboardBuilder()
     kb.button(text="❌ Нет", callback_data="repeat_none")
     kb.button(text="🔁 Каждый день", callback_data="repeat_daily")
+    kb.button(text="🏢 По будням", callback_data="repeat_weekdays")
     kb.button(text="📅 Каждую неделю", callback_data="repeat_weekly")
+    kb.button(text="🗓 Каждый месяц", callback_data="repeat_monthly")
     kb.adjust(1)
     return kb.as_markup()
 
+async def user_now(user_id):
+    """(пояс пользователя, местное время без tzinfo)"""
+    tz = await db.get_user_tz(user_id)
+    return tz, datetime.now(recurrence.zone(tz)).replace(tzinfo=None)
+
 def profile_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="🎲 Случайная заметка", callback_data="random_note")
@@ -63,6 +94,17 @@ def profile_kb():
     kb.adjust(1)
     return kb.as_markup()
 
+def export_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="📄 TXT", callback_data="export_txt")
+    kb.button(text="🧾 JSON Lines", callback_data="export_jsonl")
+    kb.button(text="📝 Markdown", callback_data="export_md")
+    kb.button(text="🗜 TXT.gz", callback_data="export_txt_gz")
+    kb.button(text="🗜 JSONL.gz", callback_data="export_jsonl_gz")
+    kb.button(text="🗜 MD.gz", callback_data="export_md_gz")
+    kb.adjust(3)
+    return kb.as_markup()
+
 def cancel_kb(): return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🚫 Отмена", callback_data="cancel_action")]])
 
 # --- Start ---
@@ -82,7 +124,17 @@ async def btn_media(msg: Message): await show_media_list(msg, msg.from_user.id,
 @router.message(F.text == "👤 Профиль")
 async def btn_profile(msg: Message):
     n, m, r = await db.get_stats(msg.from_user.id)
-    await msg.answer(f"👤 <b>Статистика:</b>\n📝 Заметок: {n}\n💾 Файлов: {m}\n⏰ Напоминаний: {r}\n🌍 Время: Москва (UTC+3)", reply_markup=profile_kb(), parse_mode="HTML")
+    tz = await db.get_user_tz(msg.from_user.id) or recurrence.DEFAULT_TZ
+    await msg.answer(f"👤 <b>Статистика:</b>\n📝 Заметок: {n}\n💾 Файлов: {m}\n⏰ Напоминаний: {r}\n🌍 Пояс: {tz} (/tz - сменить)", reply_markup=profile_kb(), parse_mode="HTML")
+
+@router.message(Command("tz"))
+async def set_tz(msg: Message, command: CommandObject):
+    if not command.args:
+        return await msg.answer("🌍 Пришли пояс, например: /tz Europe/Berlin")
+    tz = recurrence.zone_name(command.args.strip())
+    if not tz: return await msg.answer("❌ Не знаю такой пояс. Пример: /tz Asia/Yekaterinburg")
+    await db.set_user_tz(msg.from_user.id, tz)
+    await msg.answer(f"🌍 Пояс: {tz}. Новые напоминания - по этому времени.")
 
 @router.message(F.text == "🔍 Поиск")
 async def btn_search(msg: Message, state: FSMContext):
@@ -102,26 +154,26 @@ async def handle_new_note(msg: Message):
     
     note_id = await db.add_note(msg.from_user.id, msg.text)
     
-    # Авто-дата (МСК)
-    now_msk = datetime.now(MSK_TZ).replace(tzinfo=None)
-    dt = dateparser.parse(msg.text, settings={'PREFER_DATES_FROM': 'future', 'RELATIVE_BASE': now_msk})
+    # Авто-дата (по поясу пользователя)
+    tz, now = await user_now(msg.from_user.id)
+    dt = await date_parser.parse(msg.text, now)
     
     resp = "✅ Сохранено."
-    if dt and dt > now_msk:
-        await db.add_reminder(msg.from_user.id, note_id, dt)
+    if dt and dt > now:
+        await db.add_reminder(msg.from_user.id, note_id, recurrence.to_msk(dt, tz), tz=tz)
         resp += f"\n⏰ Напомню: {dt.strftime('%d.%m %H:%M')}"
     
     await msg.answer(resp)
 
 # --- Списки ---
-async def show_notes_list(target, user_id, page):
-    notes, count = await db.get_notes_page(user_id, page)
+async def show_notes_list(target, user_id, page, cursor=None, backward=False):
+    notes, count = await db.get_notes_page(user_id, cursor, backward)
     total_pages = math.ceil(count / 5) or 1
     kb = InlineKeyboardBuilder()
     for n in notes:
         pin = "📌 " if n.is_pinned else ""
         kb.row(InlineKeyboardButton(text=f"{pin}{n.content[:25]}...", callback_data=f"view_note_{n.id}"))
-    kb.attach(InlineKeyboardBuilder.from_markup(pagination_kb(page, total_pages, "list_note")))
+    kb.attach(InlineKeyboardBuilder.from_markup(pagination_kb(page, total_pages, "list_note", *page_cursors(notes, db.NOTE_KEY))))
     
     text = f"📝 Заметки ({count} шт)"
     if isinstance(target, Message): await target.answer(text, reply_markup=kb.as_markup())
@@ -129,7 +181,7 @@ async def show_notes_list(target, user_id, page):
 
 @router.callback_query(F.data.startswith("list_note_"))
 async def cb_list_notes(cb: CallbackQuery):
-    await show_notes_list(cb.message, cb.from_user.id, int(cb.data.split("_")[-1]))
+    await show_notes_list(cb.message, cb.from_user.id, *parse_page(cb.data))
     await cb.answer()
 
 @router.callback_query(F.data.startswith("view_note_"))
@@ -151,51 +203,61 @@ async def remind_start(cb: CallbackQuery, state: FSMContext):
 
 @router.message(BotState.setting_reminder)
 async def remind_time_received(msg: Message, state: FSMContext):
-    now_msk = datetime.now(MSK_TZ).replace(tzinfo=None)
-    dt = dateparser.parse(msg.text, settings={'PREFER_DATES_FROM': 'future', 'RELATIVE_BASE': now_msk})
+    _, now = await user_now(msg.from_user.id)
+    dt = await date_parser.parse(msg.text, now)
     
-    if not dt or dt < now_msk:
+    if not dt or dt < now:
         return await msg.answer("❌ Время в прошлом или непонятно.")
     
-    await state.update_data(dt=dt) # Сохраняем время во временное хранилище
+    await state.update_data(dt=dt.isoformat()) # Сохраняем время во временное хранилище (JSON - строкой)
     await state.set_state(BotState.choosing_repeat) # Переходим к выбору повтора
-    await msg.answer(f"⏰ Время: {dt.strftime('%d.%m %H:%M')}.\n\nПовторять это напоминание?", reply_markup=repeat_kb())
+    await msg.answer(f"⏰ Время: {dt.strftime('%d.%m %H:%M')}.\n\nПовторять это напоминание?\n"
+                     f"Или пришли правило, например <code>FREQ=WEEKLY;BYDAY=MO,WE</code>", reply_markup=repeat_kb(), parse_mode="HTML")
 
-@router.callback_query(BotState.choosing_repeat)
-async def remind_repeat_received(cb: CallbackQuery, state: FSMContext):
-    repeat_mode = cb.data.split("_")[1] # none, daily, weekly
+async def save_reminder(user_id, state: FSMContext, rule):
+    """Сохраняет напоминание из FSM (время - местное пользователя) с правилом повтора, возвращает описание повтора"""
     data = await state.get_data()
-    
-    await db.add_reminder(cb.from_user.id, data['nid'], data['dt'], repeat_mode)
+    tz = await db.get_user_tz(user_id)
+    dt = datetime.fromisoformat(data['dt'])
+    rule = recurrence.parse(rule)
+    if rule: rule = rule.anchored(dt)  # час, день недели, число и фаза - от первого срабатывания
+    await db.add_reminder(user_id, data['nid'], recurrence.to_msk(dt, tz), rule.text if rule else "none", tz)
     await state.clear()
-    
-    info = {"none": "", "daily": " (Каждый день)", "weekly": " (Раз в неделю)"}[repeat_mode]
-    await cb.message.edit_text(f"✅ Напоминание установлено!{info}")
+    return recurrence.describe(rule.text) if rule else ""
+
+@router.callback_query(BotState.choosing_repeat)
+async def remind_repeat_received(cb: CallbackQuery, state: FSMContext):
+    preset = cb.data.split("_", 1)[1] # ключ recurrence.PRESETS
+    if preset not in recurrence.PRESETS: return await cb.answer()
+    info = await save_reminder(cb.from_user.id, state, recurrence.PRESETS[preset])
+    await cb.message.edit_text(f"✅ Напоминание установлено!{f' ({info})' if info else ''}")
+
+@router.message(BotState.choosing_repeat, F.text)
+async def remind_rule_received(msg: Message, state: FSMContext):
+    try: recurrence.parse(msg.text.strip())
+    except ValueError as e: return await msg.answer(f"❌ Не понял правило: {e}")
+    info = await save_reminder(msg.from_user.id, state, msg.text.strip())
+    await msg.answer(f"✅ Напоминание установлено!{f' ({info})' if info else ''}")
 
 # --- Медиа ---
 @router.message(F.photo | F.video | F.document | F.voice)
 async def handle_media(msg: Message):
-    f_id, f_type = None, None
-    if msg.photo: f_id, f_type = msg.photo[-1].file_id, "photo"
-    elif msg.video: f_id, f_type = msg.video.file_id, "video"
-    elif msg.document: f_id, f_type = msg.document.file_id, "document"
-    elif msg.voice: f_id, f_type = msg.voice.file_id, "voice"
-    await db.add_media(msg.from_user.id, f_id, f_type, msg.caption or "")
-    await msg.answer("💾 Сохранено!")
-
-async def show_media_list(target, user_id, page):
-    medias, count = await db.get_media_page(user_id, page)
+    # Альбомы и пачки файлов сохраняются одним запросом и одним ответом (media.py)
+    media.buffer.add(msg, media.media_item(msg))
+
+async def show_media_list(target, user_id, page, cursor=None, backward=False):
+    medias, count = await db.get_media_page(user_id, cursor, backward)
     kb = InlineKeyboardBuilder()
     for m in medias:
         icon = {"photo":"🖼","video":"🎥","document":"📁","voice":"🎤"}.get(m.file_type, "❓")
         kb.row(InlineKeyboardButton(text=f"{icon} {m.caption or 'Файл'}...", callback_data=f"view_media_{m.id}"))
-    kb.attach(InlineKeyboardBuilder.from_markup(pagination_kb(page, math.ceil(count/5) or 1, "list_media")))
+    kb.attach(InlineKeyboardBuilder.from_markup(pagination_kb(page, math.ceil(count/5) or 1, "list_media", *page_cursors(medias, db.MEDIA_KEY))))
     text = f"💾 Файлы ({count})"
     if isinstance(target, Message): await target.answer(text, reply_markup=kb.as_markup())
     else: await target.edit_text(text, reply_markup=kb.as_markup())
 
 @router.callback_query(F.data.startswith("list_media_"))
-async def cb_list_media(cb: CallbackQuery): await show_media_list(cb.message, cb.from_user.id, int(cb.data.split("_")[-1]))
+async def cb_list_media(cb: CallbackQuery): await show_media_list(cb.message, cb.from_user.id, *parse_page(cb.data))
 
 @router.callback_query(F.data.startswith("view_media_"))
 async def view_media(cb: CallbackQuery):
@@ -203,12 +265,23 @@ async def view_media(cb: CallbackQuery):
     if not m: return await cb.answer("Удалено")
     await cb.message.delete()
     cap = f"{m.caption or ''}\n📅 {m.created_at.strftime('%d.%m')}"
-    markup = media_control_kb(m.id)
+    # Кнопка альбома - только если от него осталось хотя бы два файла, которые можно отправить альбомом
+    album = bool(m.group_id) and await db.count_media_group(m.user_id, m.group_id, media.ALBUM_TYPES) > 1
+    markup = media_control_kb(m.id, album=album)
     if m.file_type=="photo": await cb.message.answer_photo(m.file_id, caption=cap, reply_markup=markup)
     elif m.file_type=="video": await cb.message.answer_video(m.file_id, caption=cap, reply_markup=markup)
     elif m.file_type=="document": await cb.message.answer_document(m.file_id, caption=cap, reply_markup=markup)
     elif m.file_type=="voice": await cb.message.answer_voice(m.file_id, caption=cap, reply_markup=markup)
 
+@router.callback_query(F.data.startswith("album_"))
+async def view_album(cb: CallbackQuery):
+    m = await db.get_media(int(cb.data.split("_")[-1]))
+    if not m or not m.group_id: return await cb.answer("Удалено")
+    chunks = media.album_chunks(await db.get_media_group(m.user_id, m.group_id))
+    if not chunks: return await cb.answer("Альбом пуст")
+    await cb.answer()
+    for chunk in chunks: await media.send_chunk(cb.message, chunk)
+
 # --- Доп функции ---
 @router.message(BotState.searching)
 async def search_process(msg: Message, state: FSMContext):
@@ -216,7 +289,7 @@ async def search_process(msg: Message, state: FSMContext):
     await search_engine(msg, msg.text)
 
 async def search_engine(msg, query):
-    notes, count = await db.get_notes_page(msg.from_user.id, 1, 10, query)
+    notes, count = await db.search_notes(msg.from_user.id, query)
     if not notes: return await msg.answer("🔍 Ничего не нашел.")
     kb = InlineKeyboardBuilder()
     for n in notes: kb.row(InlineKeyboardButton(text=n.content[:30]+"...", callback_data=f"view_note_{n.id}"))
@@ -229,13 +302,21 @@ async def random_n(cb: CallbackQuery):
     await cb.message.edit_text(f"🎲 <b>Random:</b>\n\n{n.content}", reply_markup=note_control_kb(n.id, n.is_pinned), parse_mode="HTML")
 
 @router.callback_query(F.data == "export_notes")
-async def export(cb: CallbackQuery):
-    data = await db.get_all_notes_text(cb.from_user.id)
-    if len(data) < 50: return await cb.answer("Мало данных")
-    f = BufferedInputFile(data.encode('utf-8'), filename="backup.txt")
-    await cb.message.answer_document(f, caption="✅ Backup")
+async def export_choose(cb: CallbackQuery):
+    await cb.message.answer("📥 Формат бэкапа (заметки, файлы и напоминания):", reply_markup=export_kb())
     await cb.answer()
 
+@router.callback_query(F.data.startswith("export_"))
+async def export(cb: CallbackQuery):
+    _, fmt, *gz = cb.data.split("_")
+    if exporter.busy(cb.from_user.id): return await cb.answer("⏳ Бэкап уже готовится", show_alert=True)
+    await cb.answer("⏳ Готовлю бэкап...")
+    async with exporter.export_files(cb.from_user.id, fmt, bool(gz)) as files:
+        if not files: return await cb.message.answer("Мало данных")
+        for i, f in enumerate(files, 1):
+            caption = "✅ Backup" if len(files) == 1 else f"✅ Backup ({i}/{len(files)})"
+            await cb.message.answer_document(f, caption=caption)
+
 @router.callback_query(F.data.startswith("del_"))
 async def delete_h(cb: CallbackQuery):
     _, t, i = cb.data.split("_")
@@ -0,0 +1,92 @@
+"""Прием файлов пачками.
+
+Альбом (общий media_group_id) или пересылка многих файлов приходит отдельными апдейтами подряд.
+MediaBuffer копит файлы пользователя, пока они идут чаще чем раз в window секунд (но не дольше
+max_wait и не больше max_items), затем сохраняет их одним INSERT (db.add_media_bulk) и отвечает
+одним сообщением. Повторно присланные файлы (тот же file_unique_id) не сохраняются.
+"""
+import asyncio
+import logging
+import os
+from aiogram.types import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+import database as db
+
+ALBUM_TYPES = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+def media_item(msg: Message):
+    """Поля Media из сообщения с файлом (None, если файла нет)"""
+    if msg.photo: f, f_type, mime = msg.photo[-1], "photo", "image/jpeg"
+    elif msg.video: f, f_type, mime = msg.video, "video", msg.video.mime_type
+    elif msg.document: f, f_type, mime = msg.document, "document", msg.document.mime_type
+    elif msg.voice: f, f_type, mime = msg.voice, "voice", msg.voice.mime_type
+    else: return None
+    return {"file_id": f.file_id, "file_type": f_type, "caption": msg.caption or "", "file_unique_id": f.file_unique_id,
+            "file_size": f.file_size, "mime_type": mime, "group_id": msg.media_group_id}
+
+def album_chunks(medias):
+    """Файлы альбома -> списки InputMedia для send_media_group (до 10 штук, документы отдельно от фото/видео).
+    Голосовые в альбом не входят. Список из одного файла альбомом не отправить - см. send_chunk"""
+    groups = {}
+    for m in medias:
+        if m.file_type in ALBUM_TYPES:
+            groups.setdefault(m.file_type == "document", []).append(ALBUM_TYPES[m.file_type](media=m.file_id, caption=m.caption or None))
+    chunks = [items[i:i + 10] for items in groups.values() for i in range(0, len(items), 10)]
+    return chunks
+
+async def send_chunk(message: Message, chunk):
+    """Часть альбома в чат: send_media_group принимает 2-10 файлов, один - обычным answer_photo/video/document"""
+    if len(chunk) > 1: return await message.answer_media_group(chunk)
+    item = chunk[0]
+    send = {"photo": message.answer_photo, "video": message.answer_video, "document": message.answer_document}[item.type]
+    await send(item.media, caption=item.caption)
+
+class MediaBuffer:
+    def __init__(self, window: float = 0.5, max_items: int = 100, max_wait: float = 5):
+        self.window = window
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._pending = {}  # user_id -> {"msg", "items", "started", "timer"}
+        self._tasks = set()
+        self.batches = 0
+        self.duplicates = 0
+
+    def add(self, msg: Message, item: dict):
+        loop = asyncio.get_running_loop()
+        user_id = msg.from_user.id
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = {"msg": msg, "items": [], "started": loop.time(), "timer": None}
+        entry["items"].append(item)
+        if entry["timer"]: entry["timer"].cancel()
+        if len(entry["items"]) >= self.max_items or loop.time() - entry["started"] >= self.max_wait: self._flush(user_id)
+        else: entry["timer"] = loop.call_later(self.window, self._flush, user_id)
+
+    def _flush(self, user_id: int):
+        entry = self._pending.pop(user_id, None)
+        if not entry: return
+        if entry["timer"]: entry["timer"].cancel()
+        task = asyncio.create_task(self._save(user_id, entry["msg"], entry["items"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save(self, user_id: int, msg: Message, items):
+        try:
+            ids = await db.add_media_bulk(user_id, items)
+            self.batches += 1
+            self.duplicates += len(items) - len(ids)
+            dup = f" (уже были: {len(items) - len(ids)})" if len(ids) < len(items) else ""
+            if not ids: await msg.answer("💾 Уже сохранено")
+            else: await msg.answer("💾 Сохранено!" if len(items) == 1 else f"💾 Сохранено: {len(ids)}{dup}")
+        except Exception as e:
+            logging.error(f"Media save err: {e}")
+
+    @property
+    def pending(self):
+        return sum(len(e["items"]) for e in self._pending.values())
+
+    async def close(self):
+        """Сохраняет все накопленное (при остановке)"""
+        for user_id in list(self._pending): self._flush(user_id)
+        if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+
+buffer = MediaBuffer(float(os.getenv("MEDIA_BUFFER_SEC", 0.5)), int(os.getenv("MEDIA_BUFFER_MAX", 100)))
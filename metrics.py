@@ -0,0 +1,203 @@
+"""Метрики в формате Prometheus (text exposition) без внешних зависимостей.
+
+    METRICS_PORT=9100 python bot.py   ->   curl http://127.0.0.1:9100/metrics
+
+Что измеряется:
+    handler_seconds{handler,status}        - время хендлеров handlers.router (middleware)
+    db_query_seconds{function}             - время каждого SQL-запроса по функции database.py
+    telegram_request_seconds{method}       - вызовы Bot API
+    telegram_errors_total{method,error}    - ошибки Bot API по типу
+    reminder_lag_seconds                   - опоздание напоминания: момент забора - remind_at
+    reminder_queue_seconds                 - время в очереди отправки
+    update_wait_seconds                    - ожидание апдейта в очереди пользователя (ordering.py)
+    + gauges планировщика, отправки и кешей (снимаются в момент запроса /metrics)
+METRICS=0 отключает инструментирование.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import time
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ENABLED = os.getenv("METRICS", "1") != "0"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_registry = []
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}  # tuple(labels) -> значение
+        _registry.append(self)
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = [*key, *extra]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in list(self.values.items()):
+            yield f"{self.name}{self._labels(key)} {value}"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(labels.items())
+        self.values[key] = self.values.get(key, 0) + value
+
+class Gauge(Metric):
+    """Значение задается set() или снимается функцией fn() в момент запроса"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        self.values[tuple(labels.items())] = value
+
+    def render(self):
+        if self.fn:
+            try: value = self.fn()
+            except Exception: value = None
+            if value is not None: self.values[()] = value  # None - значения еще нет
+        yield from super().render()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.items())
+        item = self.values.get(key)
+        if item is None: item = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total) in list(self.values.items()):
+            acc = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                acc += n
+                yield f"{self.name}_bucket{self._labels(key, [('le', bound)])} {acc}"
+            yield f"{self.name}_sum{self._labels(key)} {total}"
+            yield f"{self.name}_count{self._labels(key)} {acc}"
+
+def render():
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Время обработки апдейта хендлером")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время SQL-запроса по функции database.py")
+TELEGRAM_SECONDS = Histogram("telegram_request_seconds", "Время запроса к Bot API")
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Ошибки Bot API по типу")
+REMINDER_LAG = Histogram("reminder_lag_seconds", "Опоздание напоминания (забор на отправку - remind_at)", (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900))
+UPDATE_WAIT = Histogram("update_wait_seconds", "Ожидание апдейта в очереди пользователя и общего лимита (ordering.py)", (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+REMINDER_QUEUE = Histogram("reminder_queue_seconds", "Время напоминания в очереди отправки", (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300))
+
+# --- Хендлеры ---
+class HandlerTimer(BaseMiddleware):
+    """Внутренняя middleware роутера: знает, какой хендлер выбран"""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__ if "handler" in data else "unknown"
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name, status=status)
+
+def instrument_router(router):
+    if getattr(router, "_timed", False): return
+    router._timed = True
+    timer = HandlerTimer()
+    for observer in router.observers.values():
+        if observer.event_name not in ("update", "error"): observer.middleware(timer)
+
+# --- Bot API ---
+class TelegramTimer(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - start, method=name)
+
+def instrument_bot(bot):
+    bot.session.middleware(TelegramTimer())
+
+# --- База ---
+_db_function = contextvars.ContextVar("db_function", default="other")
+
+def _on_before(conn, cursor, statement, params, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+def _on_after(conn, cursor, statement, params, context, executemany):
+    DB_QUERY_SECONDS.observe(time.perf_counter() - context._metrics_start, function=_db_function.get())
+
+def instrument_db(module):
+    """Оборачивает публичные async-функции модуля (метка function у запросов) и слушает все движки"""
+    if getattr(module, "_instrumented", False): return
+    module._instrumented = True
+    for name, fn in list(vars(module).items()):
+        if name.startswith("_") or getattr(fn, "__module__", None) != module.__name__: continue
+        if inspect.iscoroutinefunction(fn):
+            def wrap(fn=fn, name=name):
+                @functools.wraps(fn)
+                async def inner(*a, **kw):
+                    token = _db_function.set(name) if _db_function.get() == "other" else None
+                    try: return await fn(*a, **kw)
+                    finally:
+                        if token: _db_function.reset(token)
+                return inner
+            setattr(module, name, wrap())
+        elif inspect.isasyncgenfunction(fn):
+            def wrap_gen(fn=fn, name=name):
+                @functools.wraps(fn)
+                async def inner(*a, **kw):
+                    token = _db_function.set(name) if _db_function.get() == "other" else None
+                    try:
+                        async for item in fn(*a, **kw): yield item
+                    finally:
+                        if token: _db_function.reset(token)
+                return inner
+            setattr(module, name, wrap_gen())
+    if not event.contains(Engine, "before_cursor_execute", _on_before):
+        event.listen(Engine, "before_cursor_execute", _on_before)
+        event.listen(Engine, "after_cursor_execute", _on_after)
+
+# --- HTTP ---
+async def _metrics(request):
+    from aiohttp import web
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def serve(port: int, host: str = "127.0.0.1"):
+    """Поднимает /metrics на host:port (в фоне, до конца процесса)"""
+    from aiohttp import web  # aiohttp.web - только если /metrics включен
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,238 @@
+"""Версионные миграции схемы bot.db.
+
+Применяются по порядку при старте (db.init_db) или вручную:
+    python migrations.py            - применить недостающие
+    python migrations.py status     - текущая версия и список миграций
+    python migrations.py explain    - EXPLAIN QUERY PLAN всех запросов database.py
+
+Каждая миграция идемпотентна: на свежей базе create_all уже создал таблицы
+и индексы моделей, миграции лишь доводят старые базы до того же вида.
+create_all идет, только пока версия в базе ниже последней - новая таблица в моделях
+тоже требует новой версии в MIGRATIONS, иначе на уже обновленных базах ее не будет.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import text, select, insert, event, inspect as sa_inspect
+
+import database as db
+
+def _indexes(*names):
+    """Создает индексы моделей по имени (CREATE INDEX IF NOT EXISTS)"""
+    async def run(conn):
+        by_name = {idx.name: idx for t in db.Base.metadata.tables.values() for idx in t.indexes}
+        for name in names:
+            await conn.run_sync(by_name[name].create, checkfirst=True)
+    return run
+
+def _add_column(table: str, column: str):
+    """ALTER TABLE ADD COLUMN по описанию колонки в модели, если ее еще нет"""
+    async def run(conn):
+        have = await conn.run_sync(lambda c: {col["name"] for col in sa_inspect(c).get_columns(table)})
+        if column in have: return
+        col = db.Base.metadata.tables[table].c[column]
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col.type.compile(conn.dialect)}"))
+    return run
+
+def _steps(*fns):
+    """Несколько шагов в одной миграции"""
+    async def run(conn):
+        for fn in fns: await fn(conn)
+    return run
+
+async def _fts_notes(conn):
+    """FTS5-индекс заметок, триггеры синхронизации и хештеги по уже существующим заметкам"""
+    if conn.dialect.name == "postgresql": return await _trgm_notes(conn)
+    exists = await conn.scalar(text("SELECT count(*) FROM sqlite_master WHERE name = 'notes_fts'"))
+    if not exists:
+        try:
+            await conn.execute(text("CREATE VIRTUAL TABLE notes_fts USING fts5(content, owner, content='', tokenize='unicode61 remove_diacritics 2')"))
+        except Exception as e:
+            # SQLite собран без FTS5 - остается поиск через LIKE
+            logging.warning(f"FTS5 недоступен: {e}")
+            return
+        await conn.execute(text("INSERT INTO notes_fts(rowid, content, owner) SELECT id, content, user_id FROM notes"))
+    for ddl in (
+        "CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN "
+        "INSERT INTO notes_fts(rowid, content, owner) VALUES (new.id, new.content, new.user_id); END",
+        "CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN "
+        "INSERT INTO notes_fts(notes_fts, rowid, content, owner) VALUES ('delete', old.id, old.content, old.user_id); END",
+        "CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF content ON notes BEGIN "
+        "INSERT INTO notes_fts(notes_fts, rowid, content, owner) VALUES ('delete', old.id, old.content, old.user_id); "
+        "INSERT INTO notes_fts(rowid, content, owner) VALUES (new.id, new.content, new.user_id); END",
+    ):
+        await conn.execute(text(ddl))
+    if not exists:
+        last_id = 0
+        while True:
+            rows = (await conn.execute(select(db.Note.id, db.Note.user_id, db.Note.content).where(db.Note.id > last_id).order_by(db.Note.id).limit(5000))).all()
+            if not rows: break
+            tags = [{"note_id": i, "user_id": u, "tag": t} for i, u, c in rows for t in db.extract_tags(c)]
+            if tags: await conn.execute(insert(db.NoteTag).prefix_with("OR IGNORE"), tags)
+            last_id = rows[-1][0]
+
+async def _trgm_notes(conn):
+    """PostgreSQL: триграммный индекс под ILIKE '%...%' (нужно расширение pg_trgm)"""
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_notes_content_trgm ON notes USING gin (content gin_trgm_ops)"))
+    except Exception as e:
+        logging.warning(f"pg_trgm недоступен, поиск без индекса: {e}")
+
+# (версия, описание, async fn(conn)) - только добавлять в конец
+MIGRATIONS = [
+    (1, "индексы списков по user_id (notes, media)", _indexes("ix_notes_user_page", "ix_media_user_page")),
+    (2, "индексы напоминаний: user_id, note_id, (is_sent, remind_at)", _indexes("ix_reminders_user", "ix_reminders_note", "ix_reminders_due")),
+    (3, "FTS5-поиск и хештеги", _fts_notes),
+    (4, "reminders.claimed_at (захват напоминаний планировщиком)", _add_column("reminders", "claimed_at")),
+    (5, "media: file_unique_id, размер, mime, альбом; уникальность файла у пользователя",
+     _steps(*(_add_column("media", c) for c in ("file_unique_id", "file_size", "mime_type", "group_id")),
+            _indexes("ux_media_user_file", "ix_media_user_group"))),
+    (6, "часовые пояса и правила повтора: users.tz, reminders.tz, reminders.repeat_left",
+     _steps(_add_column("users", "tz"), _add_column("reminders", "tz"), _add_column("reminders", "repeat_left"))),
+]
+
+async def current_version(conn):
+    await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"))
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+async def upgrade(engine=None):
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает итоговую версию"""
+    engine = engine or db.engine
+    async with engine.begin() as conn:
+        version = await current_version(conn)
+    for num, title, fn in MIGRATIONS:
+        if num <= version: continue
+        async with engine.begin() as conn:
+            await fn(conn)
+            await conn.execute(text("INSERT INTO schema_version (version, applied_at) VALUES (:v, :t)"), {"v": num, "t": datetime.now()})
+        logging.info(f"Миграция {num}: {title}")
+        version = num
+    return version
+
+async def status(apply=False):
+    if apply: await db.init_db()
+    async with db.engine.begin() as conn:
+        version = await current_version(conn)
+    for num, title, _ in MIGRATIONS:
+        print(f"{'✅' if num <= version else '⏳'} {num}: {title}")
+    print(f"Версия схемы: {version}")
+
+# --- Проверка планов запросов ---
+async def _exercise():
+    """Вызывает каждую функцию database.py, чтобы собрать все ее запросы"""
+    now = datetime.now()
+    await db.add_user(1, "u")
+    nid = await db.add_note(1, "заметка #тег на завтра")
+    await db.add_note(1, "вторая")
+    await db.add_media(1, "file", "photo", "cap")
+    await db.add_media_bulk(1, [{"file_id": "a", "file_type": "photo", "file_unique_id": "ua", "group_id": "g"},
+                                {"file_id": "b", "file_type": "photo", "file_unique_id": "ub", "group_id": "g"}])
+    await db.get_media_group(1, "g")
+    await db.detect_fts()
+    await db.count_media_group(1, "g", ("photo", "video"))
+    rid = await db.add_reminder(1, nid, now + timedelta(minutes=1), "daily")
+    notes, _ = await db.get_notes_page(1)
+    await db.get_notes_page(1, db.encode_cursor([getattr(notes[-1], c.key) for c in db.NOTE_KEY]))
+    await db.get_notes_page(1, db.encode_cursor([getattr(notes[0], c.key) for c in db.NOTE_KEY]), True)
+    await db.get_notes_page(1, search_query="зам")
+    medias, _ = await db.get_media_page(1)
+    await db.get_media_page(1, db.encode_cursor([getattr(medias[0], c.key) for c in db.MEDIA_KEY]))
+    await db.search_notes(1, "зам")
+    await db.search_notes(1, "#тег")
+    await db.get_note(nid)
+    await db.get_media(medias[0].id)
+    await db.get_random_note(1)
+    await db.get_stats(1)
+    for kind in db.EXPORT_QUERIES:
+        async for _ in db.stream_export(1, kind): pass
+    await db.toggle_pin(nid)
+    await db.update_note_text(nid, "новый #текст")
+    await db.get_upcoming_reminders(now + timedelta(days=1))
+    await db.get_upcoming_reminders(now + timedelta(days=1), shard=(0, 2))
+    await db.get_pending_reminders(now + timedelta(days=1), [rid])
+    await db.release_reminders([rid])
+    await db.get_pending_reminders(now + timedelta(days=1))
+    await db.release_reminders(claimed_before=now)
+    await db.process_reminder_repeat(rid)
+    await db.process_reminders_repeat([rid])
+    await db.add_reminder(1, nid, now, "FREQ=WEEKLY;BYDAY=MO,FR;COUNT=3", "Europe/Berlin")
+    await db.set_user_tz(1, "Europe/Berlin")
+    await db.get_user_tz(1)
+    await db.fsm_set("fsm:1", now, now + timedelta(days=1), state="s", data="{}")
+    await db.fsm_set("fsm:1", now, now + timedelta(days=1), state=None)
+    await db.fsm_get("fsm:1", now)
+    await db.fsm_count(now)
+    await db.fsm_purge(now)
+    await db.delete_item("media", medias[0].id)
+    await db.delete_item("note", nid)
+
+async def explain():
+    """EXPLAIN QUERY PLAN для каждого запроса database.py на временной базе. Код 1, если есть полный скан таблицы"""
+    path = os.path.join(tempfile.mkdtemp(), "explain.db")
+    db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{path}"))
+    captured, current = [], [None]
+
+    @event.listens_for(db.engine.sync_engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, params, context, executemany):
+        if statement.lstrip().split()[0].upper() in ("SELECT", "UPDATE", "DELETE") and not executemany:
+            captured.append((current[0], statement, params))
+
+    await db.init_db()
+    captured.clear()
+    # Оборачиваем функции модуля, чтобы знать, из какой пришел запрос
+    called = set()
+    for name in dir(db):
+        fn = getattr(db, name)
+        if getattr(fn, "__module__", None) != db.__name__ or name.startswith("_"): continue
+        if asyncio.iscoroutinefunction(fn):
+            def wrap(fn=fn, name=name):
+                async def inner(*a, **kw):
+                    outer, current[0] = current[0], current[0] or name
+                    called.add(name)
+                    try: return await fn(*a, **kw)
+                    finally: current[0] = outer
+                return inner
+            setattr(db, name, wrap())
+        elif inspect.isasyncgenfunction(fn):
+            def wrap_gen(fn=fn, name=name):
+                async def inner(*a, **kw):
+                    outer, current[0] = current[0], current[0] or name
+                    called.add(name)
+                    try:
+                        async for item in fn(*a, **kw): yield item
+                    finally: current[0] = outer
+                return inner
+            setattr(db, name, wrap_gen())
+    await _exercise()
+    await db.engine.dispose()
+
+    bad = 0
+    con = sqlite3.connect(path)
+    seen = set()
+    for fn, sql, params in captured:
+        if (fn, sql) in seen: continue
+        seen.add((fn, sql))
+        plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        scans = [p for p in plan if p.startswith("SCAN ") and "VIRTUAL TABLE" not in p and " USING " not in p
+                 and p not in ("SCAN CONSTANT ROW", "SCAN sqlite_master")]  # sqlite_master - каталог схемы, не таблица данных
+        bad += bool(scans)
+        print(f"{'❌' if scans else '✅'} {fn}: {' '.join(sql.split())[:110]}")
+        for p in plan: print(f"      {p}")
+    missing = sorted(n for n in dir(db) if (asyncio.iscoroutinefunction(getattr(db, n)) or inspect.isasyncgenfunction(getattr(db, n)))
+                     and not n.startswith("_") and n not in called and n != "init_db")
+    if missing: print(f"⚠️ Не проверены (добавьте в _exercise): {', '.join(missing)}")
+    print(f"Полных сканов: {bad}")
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if cmd == "explain": sys.exit(asyncio.run(explain()))
+    asyncio.run(status(apply=cmd != "status"))
@@ -0,0 +1,156 @@
+"""Очередь апдейтов по пользователям.
+
+UserScheduler - outer middleware диспетчера: апдейты одного пользователя (from_user.id)
+обрабатываются строго по одному и по порядку, разных пользователей - параллельно, но не больше
+concurrency одновременно. Пока апдейт пользователя ждет общего слота, следующие ждут в его
+очереди, поэтому один пользователь занимает не больше одного слота и не может вытеснить
+остальных (слоты выдаются по очереди).
+
+Апдейты не теряются: coalesce(update) -> ключ или None, и из ждущих апдейтов с одинаковым ключом
+обрабатывается только последний (см. handlers.coalesce_key - листание одного сообщения, повторные
+кнопки меню: ответ на последнее нажатие отвечает и на предыдущие). Отброшенные нажатия кнопок
+получают пустой answer(), чтобы у пользователя не висели часики. Все остальное ждет.
+
+Обратное давление - admit(update): прием апдейта (webhook.WebhookServer - webhook, long polling,
+воркеры supervisor.py) ждет, пока у его пользователя меньше queue_size принятых и еще не обработанных
+апдейтов, и только потом занимает слот приема. Ждет апдейт в своей задаче (WebhookServer.submit),
+поэтому прием апдейтов других пользователей за ним не стоит. Так заметки и файлы флудящего
+пользователя сохраняются, а слоты приема не забиты его очередью.
+
+Middleware должна стоять до FSMContextMiddleware (см. bot.create_dispatcher): состояние FSM
+читается уже в порядке очереди, и шаги сценария (edit_s -> edit_f) не обгоняют друг друга.
+"""
+import asyncio
+import functools
+import time
+from collections import deque
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+import metrics
+
+def _nothing():
+    pass
+
+class _UserQueue:
+    __slots__ = ("busy", "waiting")
+
+    def __init__(self):
+        self.busy = False  # апдейт пользователя в работе (или ему передана очередь)
+        self.waiting = deque()  # [ключ coalesce, Future: False - твоя очередь, True - отброшен]
+
+class UserScheduler(BaseMiddleware):
+    def __init__(self, concurrency: int = 32, queue_size: int = 20, coalesce=None):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.coalesce = coalesce
+        self._slots = asyncio.Semaphore(concurrency)
+        self._users = {}  # user_id -> _UserQueue
+        self._admitted = {}  # user_id -> [принято и не обработано, deque Future ждущих приема]
+        self.running = 0
+        self.coalesced = self.throttled = 0
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        start = time.monotonic()
+        if user is None: return await self._run(handler, event, data, start)
+        if not await self._enter(user.id, event):
+            await self._skip(event)
+            return UNHANDLED
+        try:
+            return await self._run(handler, event, data, start)
+        finally:
+            self._leave(user.id)
+
+    async def _run(self, handler, event, data, start: float):
+        async with self._slots:
+            metrics.UPDATE_WAIT.observe(time.monotonic() - start)
+            self.running += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.running -= 1
+
+    async def admit(self, update):
+        """Прием апдейта: ждет, пока у его пользователя меньше queue_size принятых и еще не обработанных.
+        Возвращает done() - вызвать, когда апдейт обработан"""
+        user = UserContextMiddleware.resolve_event_context(update).user
+        if user is None: return _nothing
+        entry = self._admitted.setdefault(user.id, [0, deque()])
+        if entry[0] < self.queue_size and not entry[1]:
+            entry[0] += 1
+        else:
+            # Место освободит _release и передаст первому ждущему - порядок приема сохраняется
+            self.throttled += 1
+            fut = asyncio.get_running_loop().create_future()
+            entry[1].append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled(): self._release(user.id)  # место уже передали - отдаем следующему
+                elif fut in entry[1]: entry[1].remove(fut)
+                raise
+        return functools.partial(self._release, user.id)
+
+    def _release(self, user_id: int):
+        """Место в очереди приема - следующему ждущему, без ждущих освобождается; пустую запись удаляет"""
+        entry = self._admitted[user_id]
+        while entry[1]:
+            fut = entry[1].popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        entry[0] -= 1
+        if not entry[0]: del self._admitted[user_id]
+
+    async def _enter(self, user_id: int, event):
+        """Ждет очереди пользователя. False - апдейт отброшен: пришел более новый с тем же ключом coalesce"""
+        q = self._users.get(user_id)
+        if q is None: q = self._users[user_id] = _UserQueue()
+        if not q.busy:
+            q.busy = True
+            return True
+        key = self.coalesce(event) if self.coalesce else None
+        if key is not None:
+            for item in q.waiting:
+                if item[0] == key and not item[1].done():
+                    q.waiting.remove(item)
+                    item[1].set_result(True)
+                    self.coalesced += 1
+                    break
+        item = [key, asyncio.get_running_loop().create_future()]
+        q.waiting.append(item)
+        try:
+            return not await item[1]
+        except asyncio.CancelledError:
+            if item[1].done() and not item[1].cancelled() and not item[1].result(): self._leave(user_id)  # очередь уже передали
+            elif item in q.waiting: q.waiting.remove(item)
+            raise
+
+    def _leave(self, user_id: int):
+        """Передает очередь следующему ждущему апдейту пользователя"""
+        q = self._users[user_id]
+        while q.waiting:
+            fut = q.waiting.popleft()[1]
+            if not fut.done():  # отмененный (остановка) пропускаем
+                fut.set_result(False)
+                return
+        del self._users[user_id]
+
+    @staticmethod
+    async def _skip(event):
+        if event.callback_query:
+            try: await event.callback_query.answer()
+            except Exception: pass
+
+    @property
+    def admitted(self):
+        return sum(entry[0] for entry in self._admitted.values())
+
+    @property
+    def queued(self):
+        return sum(len(q.waiting) for q in self._users.values())
+
+    @property
+    def deepest(self):
+        return max((len(q.waiting) for q in self._users.values()), default=0)
@@ -0,0 +1,348 @@
+"""Правила повтора напоминаний (подмножество RRULE из RFC 5545) по часовому поясу пользователя.
+
+    FREQ=DAILY;BYHOUR=9;BYMINUTE=0                     - каждый день в 9:00 по местному времени
+    FREQ=WEEKLY;BYDAY=MO,WE,FR;UNTIL=20270101T000000   - по пн, ср, пт до 1 января
+    FREQ=MONTHLY;BYMONTHDAY=1,-1                       - первого и последнего числа месяца
+    FREQ=HOURLY;INTERVAL=4;COUNT=10                    - каждые 4 часа, 10 раз
+Части: FREQ (MINUTELY, HOURLY, DAILY, WEEKLY, MONTHLY), INTERVAL, BYDAY, BYMONTHDAY, BYHOUR,
+BYMINUTE, UNTIL и DTSTART (местное время), COUNT. Старые значения "none"/"daily"/"weekly" тоже понимаются.
+
+DAILY/WEEKLY/MONTHLY идут по местным часам: "каждый день в 9:00" остается в 9:00 и после перехода
+на летнее время. Несуществующее местное время (весной) сдвигается вперед на величину перехода,
+из повторяющегося (осенью) берется первое - как в RFC 5545. MINUTELY/HOURLY - по абсолютному времени.
+
+remind_at в базе - наивное московское время; здесь все считается в секундах epoch (UTC).
+Calendar хранит для каждого шаблона (правило + пояс) массив ближайших срабатываний, следующее
+срабатывание напоминания - bisect по массиву его шаблона.
+"""
+import bisect
+import calendar as cal
+import functools
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+import pytz
+
+DEFAULT_TZ = "Europe/Moscow"
+MSK_OFFSET = 3 * 3600  # Москва без перехода на летнее время с 2014 г.
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORD = EPOCH.toordinal()
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+STEPS = {"MINUTELY": 60, "HOURLY": 3600}
+FREQS = ("MINUTELY", "HOURLY", "DAILY", "WEEKLY", "MONTHLY")
+LEGACY = {"daily": "FREQ=DAILY", "weekly": "FREQ=WEEKLY"}
+PRESETS = {"none": None, "daily": "FREQ=DAILY", "weekdays": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+           "weekly": "FREQ=WEEKLY", "monthly": "FREQ=MONTHLY"}
+
+# --- Время ---
+def msk_epoch(msk: datetime):
+    return (msk - EPOCH).total_seconds() - MSK_OFFSET
+
+def epoch_msk(ts: float):
+    return EPOCH + timedelta(seconds=ts + MSK_OFFSET)
+
+def now_msk():
+    return datetime.now(pytz.utc).replace(tzinfo=None) + timedelta(seconds=MSK_OFFSET)
+
+@functools.lru_cache(maxsize=None)
+def zone(name: str):
+    return pytz.timezone(name or DEFAULT_TZ)
+
+def zone_name(name: str):
+    """Каноническое имя пояса (регистр не важен) или None"""
+    try: return pytz.timezone(name).zone
+    except pytz.UnknownTimeZoneError: return None
+
+def _localize(tz, local: datetime):
+    """Местное время -> aware: из несуществующего - вперед на переход, из повторяющегося - первое"""
+    try: return tz.localize(local, is_dst=None)
+    except pytz.NonExistentTimeError: return tz.localize(local, is_dst=False)
+    except pytz.AmbiguousTimeError: return tz.localize(local, is_dst=True)
+
+def local_epoch(tz_name: str, local: datetime):
+    """Местное время пояса -> epoch"""
+    return _utc(tz_name, local.toordinal(), local.hour * 3600 + local.minute * 60 + local.second) + local.microsecond / 1e6
+
+def to_msk(local: datetime, tz_name: str):
+    """Местное время пользователя -> наивное МСК (как хранится remind_at)"""
+    return epoch_msk(local_epoch(tz_name, local))
+
+def from_msk(msk: datetime, tz_name: str):
+    """Наивное МСК -> местное время пользователя (наивное)"""
+    return datetime.fromtimestamp(msk_epoch(msk), zone(tz_name)).replace(tzinfo=None)
+
+@functools.lru_cache(maxsize=100_000)
+def _day_offsets(tz_name: str, ordinal: int):
+    """Смещение пояса в начале и в конце местных суток"""
+    tz, day = zone(tz_name), datetime.fromordinal(ordinal)
+    return _localize(tz, day).utcoffset().total_seconds(), _localize(tz, day + timedelta(hours=23, minutes=59)).utcoffset().total_seconds()
+
+def _utc(tz_name: str, ordinal: int, sec: int):
+    """Местные (день, секунда суток) -> epoch. В дни без перехода - без pytz"""
+    start, end = _day_offsets(tz_name, ordinal)
+    if start == end: return (ordinal - EPOCH_ORD) * 86400 + sec - start
+    return _localize(zone(tz_name), datetime.fromordinal(ordinal) + timedelta(seconds=sec)).timestamp()
+
+@functools.lru_cache(maxsize=4096)
+def _midnights(tz_name: str, days: tuple):
+    """epoch местной полуночи для каждого дня (без учета перехода) и номера дней с переходом"""
+    offsets = [_day_offsets(tz_name, d) for d in days]
+    return [(d - EPOCH_ORD) * 86400 - start for d, (start, _) in zip(days, offsets)], [i for i, (a, b) in enumerate(offsets) if a != b]
+
+@functools.lru_cache(maxsize=4096)
+def _days(freq: str, interval: int, phase: int, byday, bymonthday, first: int, last: int):
+    """Подходящие местные дни (ordinal) в [first, last]"""
+    if freq == "MONTHLY":
+        days, d = [], datetime.fromordinal(first)
+        for month in range(d.year * 12 + d.month - 1, (d.year + (last - first) // 365 + 2) * 12):
+            if month % interval != phase: continue
+            year, m = divmod(month, 12)
+            start, size = datetime(year, m + 1, 1).toordinal(), cal.monthrange(year, m + 1)[1]
+            if start > last: break
+            days += [start + x - 1 for x in sorted({x if x > 0 else size + 1 + x for x in bymonthday if abs(x) <= size}) if first <= start + x - 1 <= last]
+        return tuple(days)
+    period = (lambda o: o) if freq == "DAILY" else (lambda o: (o - 1) // 7)
+    return tuple(o for o in range(first, last + 1) if period(o) % interval == phase and (byday is None or (o - 1) % 7 in byday))
+
+# --- Правило ---
+def _stamp(value: str):
+    if len(value) >= 15 and value[8] == "T" and value[:8].isdigit() and value[9:15].isdigit():  # как пишет anchored - без strptime
+        return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]), int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    return datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S" if "T" in value else "%Y%m%d")
+
+def _ints(value: str, lo: int, hi: int, name: str):
+    items = sorted({int(x) for x in value.split(",")})
+    if not items or any(not lo <= abs(x) <= hi for x in items): raise ValueError(f"{name}: {value}")
+    return tuple(items)
+
+class Rule:
+    """Разобранное правило. text - каноническая запись (ее хранит repeat_interval)"""
+
+    def __init__(self, text: str):
+        text = LEGACY.get(text, text)
+        try: parts = dict(p.split("=", 1) for p in text.upper().removeprefix("RRULE:").split(";") if p)
+        except ValueError: raise ValueError(f"Bad rule: {text}")
+        unknown = set(parts) - {"FREQ", "INTERVAL", "BYDAY", "BYMONTHDAY", "BYHOUR", "BYMINUTE", "UNTIL", "COUNT", "DTSTART"}
+        if unknown: raise ValueError(f"Unsupported: {', '.join(sorted(unknown))}")
+        self.freq = parts.get("FREQ")
+        if self.freq not in FREQS: raise ValueError(f"FREQ: {self.freq}")
+        self.interval = int(parts.get("INTERVAL", 1))
+        if self.interval < 1: raise ValueError("INTERVAL")
+        self.byday = tuple(sorted(WEEKDAYS.index(d) for d in parts["BYDAY"].split(","))) if "BYDAY" in parts else None
+        self.bymonthday = _ints(parts["BYMONTHDAY"], 1, 31, "BYMONTHDAY") if "BYMONTHDAY" in parts else None
+        self.byhour = _ints(parts["BYHOUR"], 0, 23, "BYHOUR") if "BYHOUR" in parts else None
+        self.byminute = _ints(parts["BYMINUTE"], 0, 59, "BYMINUTE") if "BYMINUTE" in parts else None
+        if self.freq in STEPS and (self.byday or self.bymonthday or self.byhour or self.byminute):
+            raise ValueError("BY* only for DAILY, WEEKLY, MONTHLY")
+        if self.byday and self.freq != "WEEKLY" or self.bymonthday and self.freq != "MONTHLY": raise ValueError("BYDAY/BYMONTHDAY")
+        self.until = _stamp(parts["UNTIL"]) if "UNTIL" in parts else None
+        self.count = int(parts["COUNT"]) if "COUNT" in parts else None
+        if self.count is not None and self.count < 1: raise ValueError("COUNT")
+        self.dtstart = _stamp(parts["DTSTART"]) if "DTSTART" in parts else None
+        # Не заданные день недели, число и время берутся из DTSTART
+        start = self.dtstart or EPOCH
+        if self.freq == "WEEKLY" and not self.byday: self.byday = (start.weekday(),)
+        if self.freq == "MONTHLY" and not self.bymonthday: self.bymonthday = (start.day,)
+        if self.freq not in STEPS:
+            self.byhour = self.byhour or (start.hour,)
+            self.byminute = self.byminute or (start.minute,)
+        # Заданы ли в тексте все поля, которые иначе берутся из DTSTART (тогда от DTSTART - только фаза)
+        self.fixed = self.freq in STEPS or "BYHOUR" in parts and "BYMINUTE" in parts and \
+            (self.freq != "WEEKLY" or "BYDAY" in parts) and (self.freq != "MONTHLY" or "BYMONTHDAY" in parts)
+        # ... и нет фазы: DTSTART на срабатывания не влияет вовсе
+        self.free = self.fixed and self.interval == 1 and self.freq not in STEPS
+        self.seconds = tuple(h * 3600 + m * 60 for h in self.byhour for m in self.byminute) if self.freq not in STEPS else ()
+        self.text = ";".join(f"{k}={parts[k]}" for k in ("FREQ", "INTERVAL", "BYDAY", "BYMONTHDAY", "BYHOUR", "BYMINUTE", "UNTIL", "COUNT", "DTSTART")
+                             if k in parts)
+
+    def anchored(self, start: datetime):
+        """Правило, привязанное к первому срабатыванию start (местное время): недостающие час, минута,
+        день недели, число месяца и фаза INTERVAL берутся из start"""
+        parts = dict(p.split("=", 1) for p in self.text.split(";"))
+        if self.freq not in STEPS:
+            parts.setdefault("BYHOUR", str(start.hour))
+            parts.setdefault("BYMINUTE", str(start.minute))
+        if self.freq == "WEEKLY": parts.setdefault("BYDAY", WEEKDAYS[start.weekday()])
+        if self.freq == "MONTHLY": parts.setdefault("BYMONTHDAY", str(start.day))
+        parts["DTSTART"] = start.strftime("%Y%m%dT%H%M%S")
+        return parse(";".join(f"{k}={v}" for k, v in parts.items()))
+
+    def key(self, tz_name: str, start: datetime = None):
+        """Шаблон: правила с одинаковым ключом срабатывают в одни и те же моменты (DTSTART важен только фазой).
+        start - первое срабатывание вместо DTSTART: от него фаза и не заданные в тексте час, минута,
+        день недели и число, как в anchored(start)"""
+        rule = self if self.fixed or start is None else self.anchored(start)
+        start = start or self.dtstart or EPOCH
+        if self.freq in STEPS: phase = local_epoch(tz_name, start) % (STEPS[self.freq] * self.interval)
+        else: phase = self._period(start.toordinal()) % self.interval
+        until = local_epoch(tz_name, self.until) if self.until else None
+        return self.freq, self.interval, phase, rule.byday, rule.bymonthday, rule.seconds, until, zone(tz_name).zone
+
+    def _period(self, ordinal: int):
+        """Номер дня, недели (с понедельника) или месяца - для фазы INTERVAL"""
+        if self.freq == "DAILY": return ordinal
+        if self.freq == "WEEKLY": return (ordinal - 1) // 7
+        d = datetime.fromordinal(ordinal)
+        return d.year * 12 + d.month - 1
+
+def parse(text):
+    """Rule или None (без повтора). ValueError - неверное правило"""
+    if not text or text == "none": return None
+    return _parse(text)
+
+@functools.lru_cache(maxsize=100_000)
+def _parse(text: str):
+    return Rule(text)
+
+@functools.lru_cache(maxsize=100_000)
+def _anchor(text: str):
+    """(Rule без DTSTART, DTSTART или None): у каждого напоминания свой DTSTART, а правил без него -
+    единицы, их разбор общий"""
+    head, found, tail = text.partition("DTSTART=")
+    if not found: return parse(text), None
+    value, _, rest = tail.partition(";")
+    return parse((head + rest).rstrip(";")), _stamp(value)
+
+def describe(text) -> str:
+    """Коротко по-русски для ответов и бэкапа"""
+    try: rule = parse(text)
+    except ValueError: return text
+    if rule is None: return ""
+    names = {"MINUTELY": "мин.", "HOURLY": "ч.", "DAILY": "дн.", "WEEKLY": "нед.", "MONTHLY": "мес."}
+    base = {"MINUTELY": "каждую минуту", "HOURLY": "каждый час", "DAILY": "каждый день", "WEEKLY": "каждую неделю",
+            "MONTHLY": "каждый месяц"}[rule.freq] if rule.interval == 1 else f"раз в {rule.interval} {names[rule.freq]}"
+    if rule.byday == (0, 1, 2, 3, 4) and rule.interval == 1: base = "по будням"
+    elif rule.byday: base += " (" + ",".join(("пн", "вт", "ср", "чт", "пт", "сб", "вс")[d] for d in rule.byday) + ")"
+    if rule.bymonthday: base += " (" + ",".join(str(d) if d > 0 else "последнего" for d in sorted(rule.bymonthday, key=lambda d: d < 0)) + " числа)"
+    if rule.until: base += f", до {rule.until.strftime('%d.%m.%Y')}"
+    if rule.count: base += f", повторов: {rule.count}"
+    return base
+
+# --- Календарь ---
+class Calendar:
+    """Ближайшие срабатывания по шаблонам.
+
+    Для DAILY/WEEKLY/MONTHLY у шаблона есть отсортированный array('d') моментов на horizon секунд
+    вперед (считается один раз на шаблон и продлевается по мере надобности), следующее срабатывание -
+    bisect по нему. MINUTELY/HOURLY считаются формулой. Напоминания с одинаковым правилом и поясом
+    делят один массив: миллион напоминаний - это тысячи шаблонов, а не миллион разборов правил.
+    DTSTART у каждого напоминания свой: шаблон ищется по правилу без DTSTART, а разбирать DTSTART нужно
+    только правилам с фазой (INTERVAL > 1, MINUTELY/HOURLY). Индекс полных текстов - кэш не больше index_size."""
+
+    def __init__(self, horizon: float = 35 * 86400, index_size: int = 250_000):
+        self.horizon = horizon
+        self.index_size = index_size
+        self._bases = {}   # (правило без DTSTART, пояс) -> номер шаблона или -1, если важен DTSTART
+        self._index = {}   # (текст правила, пояс) -> номер шаблона; кэш, старые записи вытесняются
+        self._keys = {}    # Rule.key -> номер шаблона
+        self._rules = []   # номер -> Rule.key (частота, интервал, фаза, дни, числа, секунды суток, until, пояс)
+        self._times = []   # номер -> array('d') срабатываний
+        self._range = []   # номер -> (с, по): отрезок, на который посчитан массив
+
+    def pattern(self, text: str, tz_name: str = None, start: datetime = None):
+        """Номер шаблона. start - первое срабатывание (местное) для правил без DTSTART (старые daily/weekly):
+        такие не запоминаются - их шаблон зависит от start, а не только от текста"""
+        if start is None and (p := self._index.get((text, tz_name))) is not None: return p
+        base, found, rest = text.partition(";DTSTART=")  # anchored пишет DTSTART последним
+        if found and ";" in rest: base = text
+        p = self._bases.get((base, tz_name))
+        if p is None:
+            rule = parse(base)
+            p = self._bases[(base, tz_name)] = self._add(rule.key(tz_name or DEFAULT_TZ)) if rule.free else -1
+        if p < 0:
+            rule, dtstart = _anchor(text)
+            p = self._add(rule.key(tz_name or DEFAULT_TZ, dtstart or rule.dtstart or start))
+            if start is not None and not dtstart: return p
+        if len(self._index) >= self.index_size:
+            for old in list(islice(self._index, len(self._index) // 2)): del self._index[old]
+        self._index[(text, tz_name)] = p
+        return p
+
+    def _add(self, key):
+        p = self._keys.get(key)
+        if p is None:
+            p = self._keys[key] = len(self._rules)
+            self._rules.append(key)
+            self._times.append(array("d"))
+            self._range.append((0, 0))
+        return p
+
+    def _fill(self, p: int, start: float, span: float):
+        freq, interval, phase, byday, bymonthday, seconds, until, tz_name = self._rules[p]
+        end, times = start + span, array("d")
+        if freq in STEPS:
+            step = STEPS[freq] * interval
+            if span / step <= 100_000:
+                first = start - (start - phase) % step
+                times.extend(first + step * k for k in range(int(span // step) + 2) if start <= first + step * k < end)
+                if until is not None: times = array("d", (ts for ts in times if ts <= until))
+            self._times[p], self._range[p] = times, (start, end)
+            return
+        # Дни и полуночи общие у всех шаблонов с тем же набором дней и поясом - считаются один раз на окно
+        first = EPOCH_ORD + int(start // 86400) - 1  # с запасом на любой пояс
+        days = _days(freq, interval, phase, byday, bymonthday, first, EPOCH_ORD + int(end // 86400) + 1)
+        midnights, odd = _midnights(tz_name, days)
+        found = [m + sec for m in midnights for sec in seconds]
+        for i in odd: found[i * len(seconds):(i + 1) * len(seconds)] = [_utc(tz_name, days[i], sec) for sec in seconds]
+        last = end if until is None else min(end, until + 1)
+        times.extend(ts for ts in found if start <= ts < last)
+        self._times[p], self._range[p] = times, (start, end)
+
+    def next(self, p: int, after: float):
+        """Первое срабатывание шаблона строго после after (epoch) или None"""
+        freq, interval, phase, *_, until, _ = self._rules[p]
+        if freq in STEPS:
+            step = STEPS[freq] * interval
+            ts = after - (after - phase) % step + step
+            return ts if until is None or ts <= until else None
+        start, end = self._range[p]
+        span = self.horizon
+        if not start <= after < end: self._fill(p, after, span)
+        while True:
+            times = self._times[p]
+            i = bisect.bisect_right(times, after)
+            if i < len(times): return times[i]
+            if until is not None and self._range[p][1] > until or span > 400 * 86400 * 8: return None
+            span *= 2  # Следующее срабатывание дальше окна (31-е число раз в полгода) - расширяем
+            self._fill(p, after, span)
+
+    def next_many(self, patterns, after):
+        """Следующие срабатывания пачки. patterns - номера шаблонов (лучше array), after - один момент
+        для всех (epoch) или последовательность той же длины.
+        Один момент (обычный случай: все сработавшие переносятся после now) - по вычислению на шаблон.
+        Иначе массивы шаблонов продлеваются один раз на весь отрезок after, дальше - только bisect"""
+        if not patterns: return []
+        if isinstance(after, (int, float)):
+            found = {p: self.next(p, after) for p in set(patterns)}
+            return list(map(found.__getitem__, patterns))
+        lo, hi = min(after), max(after)
+        for p in set(patterns):
+            start, end = self._range[p]
+            if not start <= lo <= hi < end: self._fill(p, lo, hi - lo + self.horizon)
+        times, out = self._times, []
+        append, find, nxt = out.append, bisect.bisect_right, self.next
+        for p, t in zip(patterns, after):
+            arr = times[p]
+            i = find(arr, t)
+            append(arr[i] if i < len(arr) else nxt(p, t))
+        return out
+
+calendar = Calendar()
+
+def next_times(rows, now: datetime = None):
+    """Следующие remind_at (МСК) для пачки (правило, пояс, remind_at МСК); None - повторов больше нет.
+    Пропущенные срабатывания (бот не работал) не догоняются: следующее - после now"""
+    now = now or now_msk()
+    patterns, ahead = array("l"), []
+    for i, (text, tz_name, at) in enumerate(rows):
+        if not text or text == "none": p = -1
+        elif "DTSTART=" in text: p = calendar.pattern(text, tz_name)
+        else: p = calendar.pattern(text, tz_name, from_msk(at, tz_name))  # старые daily/weekly
+        patterns.append(p)
+        if at > now: ahead.append(i)  # еще не наступило (часы разошлись) - после самого remind_at
+    it = iter(calendar.next_many(array("l", (p for p in patterns if p >= 0)), msk_epoch(now)))
+    times = [None if p < 0 else next(it) for p in patterns]
+    for i in ahead:
+        if patterns[i] >= 0: times[i] = calendar.next(patterns[i], msk_epoch(rows[i][2]))
+    msk = {ts: epoch_msk(round(ts)) for ts in set(times) if ts is not None}
+    return [None if ts is None else msk[ts] for ts in times]
@@ -0,0 +1,110 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+import database as db
+from delivery import ReminderDelivery
+from recurrence import now_msk  # Напоминания хранятся в наивном МСК
+import metrics
+
+class ReminderScheduler:
+    """Мин-куча ближайших напоминаний: спим ровно до первого remind_at.
+
+    Куча загружается на старте и обновляется через db.on_reminder_change.
+    Записи не удаляются из кучи сразу: актуальное время лежит в self._due,
+    устаревшие записи просто пропускаются при извлечении.
+    Раз в sweep_interval делается сверка с базой (подстраховка).
+    Перед отправкой напоминания забираются в базе (db.get_pending_reminders),
+    поэтому несколько экземпляров бота не отправят одно напоминание дважды.
+    Сама отправка - в ReminderDelivery.
+    shard=(номер, всего) - только напоминания с user_id % всего == номер (несколько процессов, см. supervisor.py)."""
+
+    def __init__(self, delivery: ReminderDelivery, sweep_interval: float = 600, horizon: timedelta = timedelta(days=1),
+                 claim_timeout: timedelta = timedelta(minutes=15), shard=None):
+        self.delivery = delivery
+        self.shard = shard
+        self.claim_timeout = claim_timeout
+        self.sweep_interval = sweep_interval
+        self.horizon = horizon
+        self._heap = []  # (remind_at, id)
+        self._due = {}   # id -> remind_at
+        self._wakeup = asyncio.Event()
+        self._touched = None  # id, измененные во время сверки (их данные из сверки устарели)
+        db.on_reminder_change(self._on_change)
+        delivery.on_retry = self.retry_later
+
+    def _on_change(self, r_id: int, remind_at):
+        if self._touched is not None: self._touched.add(r_id)
+        self.push(r_id, remind_at)
+
+    def push(self, r_id: int, remind_at):
+        if remind_at is None:
+            self._due.pop(r_id, None)
+            return
+        if self._due.get(r_id) == remind_at: return
+        self._due[r_id] = remind_at
+        heapq.heappush(self._heap, (remind_at, r_id))
+        # Новое напоминание раньше текущего - будим цикл
+        if self._heap[0][1] == r_id: self._wakeup.set()
+
+    def retry_later(self, r_id: int, delay: float):
+        """Повтор неотправленного напоминания через delay секунд"""
+        self.push(r_id, now_msk() + timedelta(seconds=delay))
+
+    async def sweep(self):
+        # Забранные, но так и не отправленные (процесс упал) - возвращаем в очередь
+        if released := await db.release_reminders(claimed_before=datetime.now() - self.claim_timeout, shard=self.shard):
+            logging.warning(f"Released {released} stale reminders")
+        self._touched = set()
+        try:
+            rows = await db.get_upcoming_reminders(now_msk() + self.horizon, shard=self.shard)
+        finally:
+            touched, self._touched = self._touched, None
+        for r_id, remind_at in rows:
+            # Уже отправляемые еще не перенесены в базе - не дублируем; ждущие повтора - по своему времени
+            if r_id not in self.delivery.inflight and r_id not in self.delivery.attempts and r_id not in touched:
+                self.push(r_id, remind_at)
+
+    def _pop_due(self, now: datetime):
+        ids = []
+        while self._heap and self._heap[0][0] <= now:
+            remind_at, r_id = heapq.heappop(self._heap)
+            if self._due.get(r_id) != remind_at: continue  # устаревшая запись
+            del self._due[r_id]
+            ids.append(r_id)
+        return ids
+
+    async def fire(self, r_ids, batch: int = 1000):
+        # Пачками: get_pending_reminders забирает не больше limit за раз
+        for i in range(0, len(r_ids), batch):
+            rows = await db.get_pending_reminders(now_msk(), r_ids[i:i + batch], limit=batch)
+            if self.delivery.attempts:  # повтор не понадобился (напоминание изменили или отправили)
+                for r_id in set(r_ids[i:i + batch]).difference(r.id for r, _ in rows): self.delivery.attempts.pop(r_id, None)
+            now = now_msk()
+            for r, _ in rows: metrics.REMINDER_LAG.observe((now - r.remind_at).total_seconds())
+            await self.delivery.submit(rows)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_sweep = 0
+        while True:
+            try:
+                if loop.time() >= next_sweep:
+                    await self.sweep()
+                    next_sweep = loop.time() + self.sweep_interval
+                now = now_msk()
+                r_ids = self._pop_due(now)
+                if r_ids:
+                    await self.fire(r_ids)
+                    continue
+                delay = next_sweep - loop.time()
+                if self._heap: delay = min(delay, (self._heap[0][0] - now).total_seconds())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                logging.error(f"Sched err: {e}")
+                await asyncio.sleep(1)
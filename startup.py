@@ -0,0 +1,52 @@
+"""Отчет о времени запуска (STARTUP_REPORT=1).
+
+bot.py отмечает фазы (mark): импорты, база, бот и диспетчер, первый обработанный апдейт.
+Каждая строка - длительность фазы и время от старта процесса (Linux: /proc/self/stat,
+иначе - от импорта этого модуля). Фоновые события (загрузка dateparser) - event().
+Модуль импортируется первым и не тянет ничего тяжелого.
+"""
+import os
+import time
+
+ENABLED = os.getenv("STARTUP_REPORT") == "1"
+
+def _process_age():
+    """Секунд с запуска процесса (0, если узнать нельзя)"""
+    try:
+        with open("/proc/self/stat") as f: ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return max(time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf("SC_CLK_TCK"), 0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+_start = time.monotonic() - _process_age()
+_last = _start
+_first_update = False
+
+def elapsed():
+    return time.monotonic() - _start
+
+def mark(name: str):
+    """Конец очередной фазы запуска"""
+    global _last
+    if not ENABLED: return
+    now = time.monotonic()
+    print(f"⏱ {name:<28} {(now - _last) * 1000:7.0f} мс   от старта {(now - _start) * 1000:7.0f} мс", flush=True)
+    _last = now
+
+def event(name: str):
+    """Фоновое событие (не фаза): только время от старта"""
+    if ENABLED: print(f"⏱ {name:<28} {'':>10}   от старта {elapsed() * 1000:7.0f} мс", flush=True)
+
+def watch(dp):
+    """Отмечает первый обработанный апдейт"""
+    if not ENABLED: return
+
+    async def first_update(handler, event, data):
+        global _first_update
+        try:
+            return await handler(event, data)
+        finally:
+            if not _first_update:
+                _first_update = True
+                mark("первый апдейт")
+    dp.update.outer_middleware(first_update)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database as db
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+class DBStorage(BaseStorage):
+    """FSM в таблице fsm_states основной базы: переживает перезапуск бота.
+
+    Каждая запись продлевает срок жизни на ttl; брошенные на полпути сценарии
+    истекают и удаляются purge() (его периодически вызывает run_purge)."""
+
+    def __init__(self, ttl: timedelta = timedelta(days=1)):
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    def _key(self, key: StorageKey):
+        return self.key_builder.build(key)
+
+    async def _set(self, key: StorageKey, **fields):
+        now = datetime.now()
+        await db.fsm_set(self._key(key), now, now + self.ttl, **fields)
+
+    async def get_record(self, key: StorageKey):
+        """(state, data) одним запросом"""
+        row = await db.fsm_get(self._key(key), datetime.now())
+        if not row: return None, {}
+        state, data = row
+        return state, json.loads(data) if data else {}
+
+    async def set_state(self, key: StorageKey, state=None):
+        await self._set(key, state=_state_name(state))
+
+    async def get_state(self, key: StorageKey):
+        return (await self.get_record(key))[0]
+
+    async def set_data(self, key: StorageKey, data):
+        await self._set(key, data=json.dumps(dict(data), ensure_ascii=False) if data else None)
+
+    async def get_data(self, key: StorageKey):
+        return (await self.get_record(key))[1]
+
+    async def count(self):
+        return await db.fsm_count(datetime.now())
+
+    async def purge(self):
+        return await db.fsm_purge(datetime.now())
+
+    async def close(self):
+        pass
+
+class CachedStorage(BaseStorage):
+    """Кеш в памяти поверх другого хранилища (read-through / write-through).
+
+    Чтения (get_state на каждом апдейте в FSMContextMiddleware, get_data в конце сценария)
+    обслуживаются из памяти; записи сразу уходят в хранилище. Кеш ограничен size записями (LRU)
+    и ttl секундами, поэтому память не растет с числом пользователей."""
+
+    def __init__(self, inner: BaseStorage, size: int = 10000, ttl: float = 300):
+        self.inner = inner
+        self.size = size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # StorageKey -> [state, data, истекает (monotonic)]
+        self.hits = self.misses = 0
+        self.live = None  # живых состояний в хранилище - обновляет run_purge
+
+    async def _load(self, key: StorageKey):
+        entry = self._cache.get(key)
+        if entry and entry[2] > time.monotonic():
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return entry
+        self.misses += 1
+        if hasattr(self.inner, "get_record"):
+            state, data = await self.inner.get_record(key)
+        else:
+            state, data = await self.inner.get_state(key), await self.inner.get_data(key)
+        entry = self._cache[key] = [state, data, time.monotonic() + self.ttl]
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.size: self._cache.popitem(last=False)
+        return entry
+
+    def _update(self, key: StorageKey, i: int, value):
+        if entry := self._cache.get(key): entry[i] = value
+
+    async def set_state(self, key: StorageKey, state=None):
+        await self.inner.set_state(key, state)
+        self._update(key, 0, _state_name(state))
+
+    async def get_state(self, key: StorageKey):
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data):
+        await self.inner.set_data(key, data)
+        self._update(key, 1, dict(data))
+
+    async def get_data(self, key: StorageKey):
+        return dict((await self._load(key))[1])  # копия: вызывающий может ее менять
+
+    async def count(self):
+        return await self.inner.count() if hasattr(self.inner, "count") else None
+
+    async def purge(self):
+        return await self.inner.purge() if hasattr(self.inner, "purge") else 0
+
+    def stats(self):
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    async def close(self):
+        await self.inner.close()
+
+def build_storage():
+    """FSM_STORAGE: db (по умолчанию) | redis (REDIS_URL, нужен пакет redis) | memory.
+    FSM_TTL - срок жизни состояния в секундах, FSM_CACHE_SIZE - размер кеша в памяти"""
+    kind = os.getenv("FSM_STORAGE", "db")
+    ttl = int(os.getenv("FSM_TTL", 86400))
+    if kind == "memory": return MemoryStorage()
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage  # Redis сам удаляет ключи по TTL
+        inner = RedisStorage.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), state_ttl=ttl, data_ttl=ttl)
+    else:
+        inner = DBStorage(timedelta(seconds=ttl))
+    return CachedStorage(inner, size=int(os.getenv("FSM_CACHE_SIZE", 10000)))
+
+def live_states(storage):
+    """Живых состояний FSM: MemoryStorage - подсчет в памяти, иначе последний подсчет run_purge (None - еще нет)"""
+    if isinstance(storage, MemoryStorage): return sum(1 for r in list(storage.storage.values()) if r.state)
+    return getattr(storage, "live", None)
+
+async def run_purge(storage, interval: float = 3600, refresh: float = 60):
+    """Раз в interval удаляет истекшие состояния и пишет в лог число живых;
+    раз в refresh обновляет storage.live (метрика fsm_states)"""
+    last = None
+    while True:
+        try:
+            if hasattr(storage, "purge"):
+                now = time.monotonic()
+                purged = None
+                if last is None or now - last >= interval:
+                    purged, last = await storage.purge(), now
+                storage.live = await storage.count()
+                if purged is not None:
+                    cache = storage.stats() if hasattr(storage, "stats") else {}
+                    logging.info(f"FSM: live={storage.live} purged={purged} {cache}")
+        except Exception as e:
+            logging.error(f"FSM purge err: {e}")
+        await asyncio.sleep(refresh)
@@ -0,0 +1,195 @@
+"""Запуск в несколько процессов.
+
+    WORKERS=4 python supervisor.py
+
+Супервизор один получает апдейты (long polling или BOT_MODE=webhook, как bot.py) и раскладывает
+их по процессам-воркерам по from_user.id % WORKERS: все апдейты пользователя обрабатывает один
+процесс, поэтому его FSM-сценарий и кеши не разъезжаются между процессами.
+Планировщик напоминаний в воркере берет только напоминания своих пользователей (тот же ключ).
+Упавший воркер перезапускается с новой очередью (апдейты, не взятые им из старой, теряются:
+умерший процесс мог унести с собой блокировку очереди).
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+from functools import partial
+import aiohttp
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database as db
+from bot import create_bot, create_dispatcher, start_background, get_token, updates as user_queues
+from storage import build_storage
+from webhook import WebhookServer, run_webhook
+
+def user_of(update: dict):
+    """from_user.id апдейта (0, если апдейт не от пользователя)"""
+    for key, body in update.items():
+        if isinstance(body, dict):
+            return (body.get("from") or body.get("user") or body.get("chat") or {}).get("id", 0)
+    return 0
+
+def worker_main(index: int, count: int, updates):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C обрабатывает супервизор
+    logging.basicConfig(level=logging.WARNING, format=f"[worker {index}] %(levelname)s %(message)s")
+    asyncio.run(_worker(index, count, updates))
+
+def _take(updates, limit: int = 100):
+    """Блокирующее чтение пачки апдейтов из очереди (в потоке)"""
+    batch = [updates.get()]
+    while len(batch) < limit and batch[-1] is not None:
+        try: batch.append(updates.get_nowait())
+        except queue.Empty: break
+    return batch
+
+async def _worker(index: int, count: int, updates):
+    await db.detect_fts()  # Миграции сделал супервизор; флаг FTS - свой в каждом процессе
+    bot = create_bot(get_token())
+    storage = build_storage()
+    dp = create_dispatcher(storage)
+    shutdown = start_background(bot, storage, shard=(index, count))
+    # Флудящий пользователь ждет места в своей очереди (admit) в фоне, прием воркера за ним не стоит
+    server = WebhookServer(dp, bot, concurrency=int(os.getenv("WORKER_CONCURRENCY", 64)), admit=user_queues.admit)
+    loop = asyncio.get_running_loop()
+    await dp.emit_startup(bot=bot)
+    running = True
+    while running:
+        for data in await loop.run_in_executor(None, _take, updates):
+            if data is None:
+                running = False
+                break
+            await server.submit(data)
+    await server.drain()
+    await shutdown()
+    await dp.emit_shutdown(bot=bot)
+    await bot.session.close()
+
+class Supervisor:
+    def __init__(self, count: int, queue_size: int = 10000):
+        self.count = count
+        self.queue_size = queue_size
+        # forkserver: воркеры (и перезапуски упавших) форкаются из процесса, где aiogram и модули бота уже
+        # импортированы, - без нескольких секунд импорта в каждом, как при spawn
+        self.ctx = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+        if self.ctx.get_start_method() == "forkserver":
+            # Сервер запускается через python -c и sys.path родителя не получает - папка бота через PYTHONPATH
+            os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, (os.path.dirname(os.path.abspath(__file__)), os.getenv("PYTHONPATH"))))
+            self.ctx.set_forkserver_preload(["__main__", "bot"])
+        self.queues = [self.ctx.Queue(queue_size) for _ in range(count)]
+        self.procs = [None] * count
+        self.stopping = False
+        self.restarts = 0
+
+    def _start(self, i: int):
+        self.procs[i] = self.ctx.Process(target=worker_main, args=(i, self.count, self.queues[i]), name=f"bot-worker-{i}", daemon=True)
+        self.procs[i].start()
+
+    def start(self):
+        for i in range(self.count): self._start(i)
+
+    async def route(self, update: dict):
+        await self._put(user_of(update) % self.count, update)
+
+    async def _put(self, i: int, item, deadline: float = None):
+        """Кладет в очередь воркера i. Пока она полна (воркер не успевает) - ждет по секунде и каждый раз
+        берет self.queues[i] заново: упавшему воркеру watch дает новую очередь. False - не успели до deadline"""
+        loop = asyncio.get_running_loop()
+        while True:
+            q = self.queues[i]
+            try:
+                q.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+            try:
+                await loop.run_in_executor(None, partial(q.put, item, timeout=1))
+                return True
+            except queue.Full:
+                if deadline is not None and loop.time() >= deadline: return False
+
+    async def watch(self, interval: float = 1):
+        """Перезапускает упавшие воркеры"""
+        while not self.stopping:
+            for i, p in enumerate(self.procs):
+                if not p.is_alive() and not self.stopping:
+                    logging.error(f"Worker {i} exited with code {p.exitcode}, restarting")
+                    self.restarts += 1
+                    self.queues[i] = self.ctx.Queue(self.queue_size)
+                    self._start(i)
+            await asyncio.sleep(interval)
+
+    async def poll(self, token: str, allowed_updates=None):
+        """Long polling getUpdates без разбора апдейтов - только маршрутизация"""
+        api = os.getenv("BOT_API_URL", "https://api.telegram.org").rstrip("/")
+        offset = 0
+        async with aiohttp.ClientSession() as http:
+            while True:
+                try:
+                    async with http.post(f"{api}/bot{token}/getUpdates", json={"offset": offset, "timeout": 30, "allowed_updates": allowed_updates},
+                                         timeout=aiohttp.ClientTimeout(total=40)) as resp:
+                        body = await resp.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"getUpdates err: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if not body.get("ok"):
+                    logging.warning(f"getUpdates err: {body.get('description')}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in body["result"]:
+                    await self.route(update)
+                    offset = update["update_id"] + 1
+
+    async def stop(self, timeout: float = 30):
+        """Воркеры дорабатывают свои очереди и останавливаются (не дольше timeout секунд)"""
+        self.stopping = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for i in range(self.count): await self._put(i, None, deadline)
+        for p in self.procs:
+            await loop.run_in_executor(None, p.join, max(deadline - loop.time(), 0))
+            if p.is_alive(): p.terminate()
+
+class RoutingWebhook(WebhookServer):
+    """Webhook супервизора: апдейты не обрабатываются, а уходят в очередь воркера"""
+
+    def __init__(self, supervisor: Supervisor, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.supervisor = supervisor
+
+    async def dispatch(self, data: dict):
+        await self.supervisor.route(data)
+
+async def main():
+    logging.basicConfig(level=logging.WARNING)
+    token = get_token()
+    if not token: return print("❌ Нет токена")
+    await db.init_db()  # Миграции - один раз, до запуска воркеров
+    await db.engine.dispose()
+
+    count = int(os.getenv("WORKERS", os.cpu_count() or 1))
+    dp = create_dispatcher(MemoryStorage())  # только для allowed_updates и webhook
+    sup = Supervisor(count)
+    sup.start()
+    watcher = asyncio.create_task(sup.watch())
+    print(f"🚀 Supervisor: {count} workers")
+
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        bot = create_bot(token)
+        server = RoutingWebhook(sup, dp, bot, os.getenv("WEBHOOK_SECRET"))
+        return await run_webhook(dp, bot, on_shutdown=sup.stop, server=server)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError): pass  # Windows
+    poller = asyncio.create_task(sup.poll(token, dp.resolve_used_update_types()))
+    await stop.wait()
+    poller.cancel()
+    await sup.stop()
+    watcher.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(main())
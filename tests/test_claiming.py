@@ -0,0 +1,70 @@
+"""Забор напоминаний на отправку: параллельные планировщики не получают одно напоминание дважды.
+
+SQLite - на временной базе; PostgreSQL - только если задан TEST_DATABASE_URL
+(postgresql+asyncpg://..., тестовые строки удаляются после проверки).
+"""
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, insert
+
+import database as db
+
+USER = 990000001
+COUNT = 300
+
+async def _setup(url):
+    db.set_engine(db.make_engine(url))
+    await db.init_db()
+    await _cleanup()
+    await db.add_user(USER, "claim_test")
+    note_id = await db.add_note(USER, "claim test")
+    at = datetime.now() - timedelta(minutes=1)
+    async with db.new_session() as session:
+        await session.execute(insert(db.Reminder), [{"user_id": USER, "note_id": note_id, "remind_at": at - timedelta(seconds=i),
+                                                     "repeat_interval": "none"} for i in range(COUNT)])
+        await session.commit()
+
+async def _cleanup():
+    async with db.new_session() as session:
+        for model in (db.Reminder, db.NoteTag, db.Note, db.UserCounter, db.User):
+            col = model.telegram_id if model is db.User else model.user_id
+            await session.execute(delete(model).where(col == USER))
+        await session.commit()
+
+async def _claimer(held, sent, rnd):
+    """Забирает пачки, часть возвращает (ошибка отправки), остальное отправляет"""
+    while True:
+        rows = await db.get_pending_reminders(datetime.now(), limit=rnd.randint(1, 15))
+        if not rows: return
+        ids = [rem.id for rem, _ in rows]
+        assert not held & set(ids), "напоминание забрали дважды"
+        held.update(ids)
+        await asyncio.sleep(0)
+        back = [i for i in ids if rnd.random() < 0.2]
+        done = [i for i in ids if i not in back]
+        held.difference_update(ids)
+        if back: await db.release_reminders(back)
+        if done:
+            sent.extend(done)
+            await db.process_reminders_repeat(done)
+
+async def _run(url, claimers=2):
+    await _setup(url)
+    try:
+        held, sent = set(), []
+        await asyncio.gather(*[_claimer(held, sent, random.Random(i)) for i in range(claimers)])
+        assert len(sent) == len(set(sent)) == COUNT
+    finally:
+        await _cleanup()
+        await db.engine.dispose()
+
+def test_claim_disjoint_sqlite(tmp_path):
+    asyncio.run(_run(f"sqlite+aiosqlite:///{tmp_path}/claim.db"))
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL не задан")
+def test_claim_disjoint_postgres():
+    asyncio.run(_run(os.environ["TEST_DATABASE_URL"], claimers=4))
@@ -0,0 +1,37 @@
+"""Счетчики user_counters: пользователь с заметками и файлами, но без строки счетчиков
+(база до миграции счетчиков) - страницы отдаются целыми, счетчики досчитываются."""
+import asyncio
+
+from sqlalchemy import delete, insert
+
+import database as db
+
+USER = 42
+
+async def _run(path):
+    db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{path}"))
+    try:
+        await db.init_db()
+        await db.add_user(USER, "u")
+        async with db.new_session() as session:
+            await session.execute(insert(db.Note), [{"user_id": USER, "content": f"заметка {i}"} for i in range(7)])
+            await session.execute(insert(db.Media), [{"user_id": USER, "file_id": f"f{i}", "file_type": "photo"} for i in range(3)])
+            await session.execute(delete(db.UserCounter).where(db.UserCounter.user_id == USER))
+            await session.commit()
+        db.cache.clear()
+        for _ in range(2):  # второй раз - первая страница из кеша
+            notes, count = await db.get_notes_page(USER)
+            assert count == 7 and [n.is_pinned for n in notes] == [False] * 5 and notes[0].content
+        async with db.new_session() as session:
+            await session.execute(delete(db.UserCounter).where(db.UserCounter.user_id == USER))
+            await session.commit()
+        medias, count = await db.get_media_page(USER)
+        assert count == 3 and sorted(m.file_id for m in medias) == ["f0", "f1", "f2"]
+        async with db.new_session() as session:
+            row = await session.get(db.UserCounter, USER)
+            assert (row.notes, row.media) == (7, 3)
+    finally:
+        await db.engine.dispose()
+
+def test_pages_without_counter_row(tmp_path):
+    asyncio.run(_run(tmp_path / "counters.db"))
@@ -0,0 +1,112 @@
+"""recurrence.Calendar против dateutil.rrule: правила x пояса, переходы на летнее время,
+31-е число, UNTIL; COUNT - через process_reminders_repeat на временной базе."""
+import asyncio
+import random
+from datetime import datetime, timezone
+from itertools import islice, takewhile
+
+import pytest
+
+import recurrence as rc
+
+rrule = pytest.importorskip("dateutil.rrule")
+dtz = pytest.importorskip("dateutil.tz")
+
+RULES = ["FREQ=DAILY", "FREQ=DAILY;INTERVAL=3", "FREQ=WEEKLY;BYDAY=MO,WE,FR", "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,SU",
+         "FREQ=MONTHLY;BYMONTHDAY=31", "FREQ=MONTHLY;BYMONTHDAY=1,-1", "FREQ=MONTHLY;INTERVAL=5;BYMONTHDAY=30",
+         "FREQ=HOURLY;INTERVAL=4", "FREQ=MINUTELY;INTERVAL=90", "FREQ=DAILY;BYHOUR=2,14;BYMINUTE=30",
+         "FREQ=WEEKLY;UNTIL=20270301T000000"]
+ZONES = ["Europe/Moscow", "Europe/Berlin", "America/New_York", "Australia/Sydney", "Asia/Kolkata"]
+# За два дня до перехода, в час, который пропадает (весна) или повторяется (осень)
+DST = {"Europe/Berlin": [datetime(2026, 3, 27, 2, 30), datetime(2026, 10, 23, 2, 30)],
+       "America/New_York": [datetime(2026, 3, 6, 2, 30), datetime(2026, 10, 30, 1, 30)],
+       "Australia/Sydney": [datetime(2026, 10, 2, 2, 30), datetime(2026, 4, 3, 2, 30)]}
+N = 40
+LIMIT = datetime(2037, 1, 1, tzinfo=timezone.utc).timestamp()  # dateutil.tz не знает переходов после 2037 (tzfile без POSIX-хвоста)
+
+def _starts(zone):
+    rnd = random.Random(zone)
+    return [datetime(2026, rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59))] + DST.get(zone, [])
+
+def _epoch(zone, local: datetime):
+    """Эталон местное -> epoch: несуществующее - вперед на переход, из повторяющегося - первое (fold=0)"""
+    return dtz.resolve_imaginary(local.replace(tzinfo=dtz.gettz(zone))).timestamp()
+
+def _ours(rule, zone, start):
+    p = rc.calendar.pattern(rule.text, zone)
+    out, t = [], rc.local_epoch(zone, start)
+    while len(out) < N and (t := rc.calendar.next(p, t)) is not None and t < LIMIT:
+        out.append(t)
+    return out
+
+def _reference(rule, zone, start):
+    freq = getattr(rrule, rule.freq)
+    if rule.freq in rc.STEPS:  # по абсолютному времени - считаем в UTC
+        s0 = datetime.fromtimestamp(_epoch(zone, start), timezone.utc).replace(tzinfo=None)
+        times = (d.replace(tzinfo=timezone.utc).timestamp() for d in rrule.rrule(freq, interval=rule.interval, dtstart=s0))
+    else:
+        kw = dict(interval=rule.interval, dtstart=start, byhour=rule.byhour, byminute=rule.byminute, bysecond=0,
+                  byweekday=rule.byday, bymonthday=rule.bymonthday, until=rule.until)
+        times = (_epoch(zone, d) for d in rrule.rrule(freq, **kw))
+    begin = _epoch(zone, start)
+    return list(islice(takewhile(lambda t: t < LIMIT, (t for t in times if t > begin)), N))
+
+@pytest.mark.parametrize("zone", ZONES)
+@pytest.mark.parametrize("text", RULES)
+def test_matches_dateutil(text, zone):
+    for start in _starts(zone):
+        rule = rc.parse(text).anchored(start)
+        assert _ours(rule, zone, start) == _reference(rule, zone, start), (text, zone, start)
+
+def test_dst_local_time():
+    """Каждый день в 2:30 по Берлину: в день перехода весной - 3:30, осенью - первое 2:30 (летнее)"""
+    start = datetime(2026, 3, 27, 2, 30)
+    got = [datetime.fromtimestamp(t, rc.zone("Europe/Berlin")) for t in _ours(rc.parse("FREQ=DAILY").anchored(start), "Europe/Berlin", start)[:3]]
+    assert [d.strftime("%d %H:%M%z") for d in got] == ["28 02:30+0100", "29 03:30+0200", "30 02:30+0200"]
+    start = datetime(2026, 10, 24, 2, 30)
+    got = datetime.fromtimestamp(_ours(rc.parse("FREQ=DAILY").anchored(start), "Europe/Berlin", start)[0], rc.zone("Europe/Berlin"))
+    assert got.strftime("%d %H:%M%z") == "25 02:30+0200"
+
+@pytest.mark.parametrize("text", ["FREQ=DAILY;COUNT=0", "FREQ=DAILY;COUNT=-2", "FREQ=DAILY;INTERVAL=0"])
+def test_rejects_bad_count(text):
+    with pytest.raises(ValueError):
+        rc.parse(text)
+
+def test_count_via_database(tmp_path):
+    """COUNT=3: напоминание срабатывает ровно 3 раза - в те же моменты, что и у dateutil"""
+    import database as db
+
+    zone, start = "America/New_York", datetime(2026, 3, 7, 2, 30)
+    rule = rc.parse("FREQ=DAILY;COUNT=3").anchored(start)
+    expected = [rc.epoch_msk(_epoch(zone, d)) for d in rrule.rrule(rrule.DAILY, dtstart=start, count=3)]
+
+    async def run():
+        db.set_engine(db.make_engine(f"sqlite+aiosqlite:///{tmp_path}/count.db"))
+        try:
+            await db.init_db()
+            await db.add_user(1, "u")
+            r_id = await db.add_reminder(1, await db.add_note(1, "x"), rc.to_msk(start, zone), rule.text, zone)
+            fired = []
+            while True:
+                async with db.new_session() as session:
+                    at = await session.scalar(db.select(db.Reminder.remind_at).where(db.Reminder.id == r_id))
+                if at is None: return fired
+                fired.append(at)
+                await db.process_reminders_repeat([r_id], at)
+        finally:
+            await db.engine.dispose()
+    assert asyncio.run(run()) == expected
+
+def test_index_does_not_grow():
+    """Старые daily/weekly не добавляют записей в индекс на каждое срабатывание; индекс ограничен"""
+    calendar = rc.Calendar(index_size=100)
+    at = datetime(2026, 10, 1, 9, 0)
+    for day in range(60):
+        for text in ("daily", "weekly"):
+            fired = at + rc.timedelta(days=day)
+            p = calendar.pattern(text, "Asia/Tokyo", rc.from_msk(fired, "Asia/Tokyo"))
+            assert rc.epoch_msk(calendar.next(p, rc.msk_epoch(fired))) == fired + rc.timedelta(days=1 if text == "daily" else 7)
+    assert not calendar._index and len(calendar._rules) == 1 + 7  # каждый день и по одному на день недели
+    for minute in range(1000):
+        calendar.pattern(rc.parse("FREQ=DAILY").anchored(datetime(2026, 10, 1) + rc.timedelta(minutes=minute)).text, "Asia/Tokyo")
+    assert len(calendar._index) <= 100 and len(calendar._rules) == 8 + 999  # 15:00 по Токио (9:00 МСК) уже есть
@@ -0,0 +1,200 @@
+"""Прием апдейтов: режим webhook (aiohttp-сервер принимает апдейты от Telegram) и long polling
+через тот же WebhookServer (run_polling - режим по умолчанию в bot.py).
+
+    BOT_MODE=webhook WEBHOOK_URL=https://example.com python bot.py
+
+Локальная проверка без Telegram - отправить записанные апдейты (JSON на строку) на сервер:
+    python webhook.py updates.jsonl [http://localhost:8080/webhook]
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    """Принимает апдейты и обрабатывает их в фоне, не больше concurrency одновременно.
+
+    Ответ Telegram отдается сразу после постановки апдейта в работу; когда все слоты заняты,
+    запрос ждет свободного слота (Telegram сам притормаживает отправку). admit(update) - ожидание
+    до занятия слота (ordering.UserScheduler.admit), возвращает done() - вызывается после обработки.
+    submit - прием без ожидания admit (long polling, воркеры): не больше backlog апдейтов ждут в фоне.
+    При остановке новые апдейты получают 503 (Telegram повторит их позже), а начатые дорабатываются."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = None, concurrency: int = 64, admit=None,
+                 backlog: int = 10000, **kwargs):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.admit = admit
+        self.kwargs = kwargs  # передаются в хендлеры, как workflow_data в start_polling
+        self._slots = asyncio.Semaphore(concurrency)
+        self._backlog = asyncio.Semaphore(backlog)
+        self._tasks = set()
+        self.draining = False
+        self.received = self.rejected = 0
+
+    async def handle(self, request: web.Request):
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self.draining: return web.Response(status=503)
+        try:
+            data = await request.json()
+            await self.dispatch(data)
+        except Exception as e:
+            logging.warning(f"Bad update: {e}")
+            return web.Response(status=400)
+        self.received += 1
+        return web.Response()
+
+    async def dispatch(self, data):
+        """Ставит апдейт (JSON от Telegram или Update) в обработку"""
+        update = data if isinstance(data, Update) else Update.model_validate(data, context={"bot": self.bot})
+        done = await self.admit(update) if self.admit else None
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            if done: done()
+            raise
+        task = asyncio.create_task(self._process(update, done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def submit(self, data):
+        """Как dispatch, но admit и слот апдейт ждет в своей задаче: флудящий пользователь не держит
+        прием остальных. Ждет, только если в фоне уже backlog апдейтов"""
+        await self._backlog.acquire()
+        task = asyncio.create_task(self._submit(data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _submit(self, data):
+        try:
+            await self.dispatch(data)
+        except Exception as e:
+            logging.warning(f"Bad update: {e}")
+        finally:
+            self._backlog.release()
+
+    async def _process(self, update: Update, done=None):
+        try:
+            await self.dp.feed_update(self.bot, update, **self.kwargs)
+        except Exception as e:
+            logging.error(f"Update {update.update_id} err: {e}")
+        finally:
+            self._slots.release()
+            if done: done()
+
+    async def health(self, request: web.Request):
+        return web.json_response({"status": "draining" if self.draining else "ok", "inflight": len(self._tasks),
+                                  "received": self.received, "rejected": self.rejected}, status=503 if self.draining else 200)
+
+    async def drain(self, timeout: float = 30):
+        """Перестает принимать апдейты и ждет начатые (не дольше timeout секунд)"""
+        self.draining = True
+        deadline = asyncio.get_running_loop().time() + timeout
+        # Пока ждем, могут добавиться апдейты, которые уже ждали слота
+        while self._tasks and (left := deadline - asyncio.get_running_loop().time()) > 0:
+            await asyncio.wait(list(self._tasks), timeout=left)
+        if self._tasks: logging.warning(f"Webhook: не дождались {len(self._tasks)} апдейтов")
+
+    def app(self, path: str = WEBHOOK_PATH):
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        app.router.add_get("/health", self.health)
+        return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot, on_shutdown=None, server: WebhookServer = None, admit=None):
+    """WEBHOOK_URL - публичный адрес (без него webhook в Telegram не регистрируется - для локальных тестов),
+    WEBHOOK_HOST/WEBHOOK_PORT - где слушать, WEBHOOK_SECRET - секретный токен, WEBHOOK_CONCURRENCY - параллельность.
+    Без секрета апдейт может прислать кто угодно от имени любого пользователя: с WEBHOOK_URL секрет
+    генерируется на запуск (Telegram получает его в set_webhook), без WEBHOOK_URL сервер слушает только localhost.
+    Работает до SIGINT/SIGTERM, затем дорабатывает начатое и вызывает on_shutdown()"""
+    server = server or WebhookServer(dp, bot, os.getenv("WEBHOOK_SECRET"), int(os.getenv("WEBHOOK_CONCURRENCY", 64)), admit)
+    url = os.getenv("WEBHOOK_URL")
+    if url and not server.secret:
+        server.secret = secrets.token_urlsafe(32)
+        logging.warning("WEBHOOK_SECRET не задан - сгенерирован случайный секрет")
+    runner = web.AppRunner(server.app(), handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, os.getenv("WEBHOOK_HOST", "0.0.0.0" if server.secret else "127.0.0.1"), int(os.getenv("WEBHOOK_PORT", 8080)))
+    await site.start()
+    if url:
+        await bot.set_webhook(url.rstrip("/") + WEBHOOK_PATH, secret_token=server.secret,
+                              max_connections=min(int(os.getenv("WEBHOOK_CONCURRENCY", 64)), 100),
+                              allowed_updates=dp.resolve_used_update_types())
+    await dp.emit_startup(bot=bot)
+    try:
+        await _until_signal()
+    finally:
+        logging.warning("Webhook: остановка, дорабатываем начатые апдейты")
+        await server.drain()
+        await site.stop()
+        if on_shutdown: await on_shutdown()
+        await dp.emit_shutdown(bot=bot)
+        await runner.cleanup()
+        await bot.session.close()
+
+async def poll_updates(server: WebhookServer, allowed_updates=None, timeout: int = 30):
+    """Long polling getUpdates в server.submit"""
+    bot, offset = server.bot, None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                            request_timeout=int(bot.session.timeout + timeout))
+        except Exception as e:
+            logging.warning(f"getUpdates err: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await server.submit(update)
+            offset = update.update_id + 1
+
+async def run_polling(dp: Dispatcher, bot: Bot, on_shutdown=None, admit=None):
+    """Long polling через прием WebhookServer: апдейт пользователя, у которого USER_QUEUE_SIZE необработанных,
+    ждет в своей задаче, а getUpdates и апдейты остальных идут дальше. POLLING_CONCURRENCY - апдейтов
+    в работе и в очередях пользователей. Работает до SIGINT/SIGTERM, затем как run_webhook"""
+    server = WebhookServer(dp, bot, concurrency=int(os.getenv("POLLING_CONCURRENCY", 1000)), admit=admit)
+    await dp.emit_startup(bot=bot)
+    poller = asyncio.create_task(poll_updates(server, dp.resolve_used_update_types()))
+    try:
+        await _until_signal()
+    finally:
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+        await server.drain()
+        if on_shutdown: await on_shutdown()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+async def _until_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError): pass  # Windows
+    await stop.wait()
+
+async def replay(path: str, url: str = f"http://localhost:8080{WEBHOOK_PATH}"):
+    """Отправляет апдейты из файла (JSON на строку) на webhook-сервер"""
+    from aiohttp import ClientSession
+    headers = {SECRET_HEADER: os.getenv("WEBHOOK_SECRET")} if os.getenv("WEBHOOK_SECRET") else {}
+    async with ClientSession() as session:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                async with session.post(url, json=json.loads(line), headers=headers) as resp:
+                    print(json.loads(line).get("update_id"), resp.status)
+
+if __name__ == "__main__":
+    asyncio.run(replay(*sys.argv[1:3]))